@@ -0,0 +1,73 @@
+"""
+Shell completion latency on a large synthetic diary.
+
+Run from the repository root:
+
+    python -m benchmarks.completion [--entries 50000] [--runs 20]
+
+Latency is reported both in total and on top of a bare interpreter start.
+Exits with a non-zero status if the overhead of any case exceeds the target.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.fixtures import make_diary, entry_name
+
+TARGET_OVERHEAD_MS = 30
+CASES = {
+    'entry': 'diary view 2019-0',
+    'tag': 'diary list -t t',
+    'media': f'diary media view -e {entry_name(5)} ',
+}
+
+
+def time_command(command: list[str], env: dict, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def time_completion(env: dict, line: str, runs: int) -> float:
+    words = line.split(' ')
+    env = dict(env, _DIARY_COMPLETE='bash_complete', COMP_WORDS=line, COMP_CWORD=str(len(words) - 1))
+    return time_command([sys.executable, '-m', 'diary'], env=env, runs=runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=50000)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home)
+        make_diary(Path(home), args.entries)
+        subprocess.run([sys.executable, '-m', 'diary', 'reindex'], env=env, check=True, stdout=subprocess.DEVNULL)
+
+        baseline = time_command([sys.executable, '-c', 'pass'], env=env, runs=args.runs)
+        results = {name: time_completion(env, line, args.runs) for name, line in CASES.items()}
+
+    overhead = {name: ms - baseline for name, ms in results.items()}
+    print(json.dumps({
+        'entries': args.entries,
+        'target_overhead_ms': TARGET_OVERHEAD_MS,
+        'interpreter_ms': baseline,
+        'median_ms': results,
+        'overhead_ms': overhead,
+    }, indent=2))
+    if any(ms > TARGET_OVERHEAD_MS for ms in overhead.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
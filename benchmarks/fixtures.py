@@ -0,0 +1,74 @@
+"""Synthetic diaries for benchmarks."""
+import json
+import random
+from datetime import date, timedelta
+from pathlib import Path
+
+FIRST_DAY = date(2000, 1, 1)
+COMMON_TAGS = ['work', 'family', 'travel', 'health', 'books', 'music', 'friends', 'ideas', 'sport', 'food']
+RARE_TAGS = [f'topic{i}' for i in range(100)]
+WORDS = (
+    'the a and of to in it was we i today went met read wrote walked rain sun city home office '
+    'train coffee dinner friend sister project meeting idea book film music garden sea mountain'
+).split()
+MEDIA_FILE_SIZE = 1024
+
+
+def entry_name(number: int) -> str:
+    return str(FIRST_DAY + timedelta(days=number))
+
+
+def has_media(number: int) -> bool:
+    return number % 5 == 0
+
+
+def make_text(rng: random.Random) -> str:
+    word_count = min(int(rng.lognormvariate(5, 1)), 20000)
+    lines = []
+    for start in range(0, word_count, 12):
+        lines.append(' '.join(rng.choice(WORDS) for _ in range(min(12, word_count - start))))
+    return '\n'.join(lines) + '\n'
+
+
+def make_metadata(rng: random.Random, number: int) -> dict:
+    tags = rng.sample(COMMON_TAGS, k=rng.randint(0, 3))
+    if rng.random() < 0.2:
+        tags.append(rng.choice(RARE_TAGS))
+
+    media = []
+    if has_media(number):
+        media = [
+            {'file_name': f'IMG_{number:06}_{i}.jpg', 'description': rng.choice([None, 'a photo']), 'digest': None}
+            for i in range(1 + number % 7)
+        ]
+
+    return {
+        'version': 1,
+        'title': ' '.join(rng.sample(WORDS, k=3)) if rng.random() < 0.6 else None,
+        'tags': tags,
+        'media': media,
+    }
+
+
+def make_diary(home: Path, entry_count: int, seed: int = 0):
+    """
+    Write a diary with entry_count consecutive daily entries under home.
+
+    Titles, tags and text sizes are random but reproducible for a seed;
+    every fifth entry, starting with the first one, has media files.
+    """
+
+    rng = random.Random(seed)
+    data_dir = home / '.diary' / 'data'
+    for number in range(entry_count):
+        entry_dir = data_dir / entry_name(number)
+        entry_dir.mkdir(parents=True)
+        (entry_dir / 'entry.txt').write_text(make_text(rng))
+
+        metadata = make_metadata(rng, number)
+        (entry_dir / 'meta.json').write_text(json.dumps(metadata))
+        if metadata['media']:
+            media_dir = entry_dir / 'media'
+            media_dir.mkdir()
+            for media in metadata['media']:
+                (media_dir / media['file_name']).write_bytes(rng.randbytes(MEDIA_FILE_SIZE))
@@ -0,0 +1,85 @@
+"""
+Metadata encode/decode micro-benchmark.
+
+Compares the model codec with the dataclass `asdict`-based codec it replaced,
+on entries with many media items. Run from the repository root:
+
+    python -m benchmarks.models [--media 500] [--number 200]
+"""
+import argparse
+import json
+import timeit
+from dataclasses import dataclass, field, asdict
+
+from diary.utils.models import Entry
+
+
+@dataclass
+class LegacyMediaEntry:
+    file_name: str
+    description: str = None
+    digest: str = None
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(**data)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+@dataclass
+class LegacyEntry:
+    title: str = None
+    tags: list[str] = field(default_factory=list)
+    media: list[LegacyMediaEntry] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        media = data.pop('media', [])
+        data['media'] = [LegacyMediaEntry.from_dict(m) for m in media]
+        return cls(**data)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def make_entry_data(media_count: int) -> dict:
+    return {
+        'title': 'A day at the sea',
+        'tags': ['travel', 'family', 'summer'],
+        'media': [
+            {'file_name': f'IMG_{i:04}.jpg', 'description': f'photo {i}', 'digest': f'{i:064x}'}
+            for i in range(media_count)
+        ],
+    }
+
+
+def bench(number: int, func) -> float:
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--media', type=int, default=500)
+    parser.add_argument('--number', type=int, default=200)
+    args = parser.parse_args()
+
+    content = json.dumps(make_entry_data(args.media))
+    legacy = LegacyEntry.from_dict(json.loads(content))
+    entry = Entry.from_dict(json.loads(content))
+
+    results = {
+        'legacy_decode_us': bench(args.number, lambda: LegacyEntry.from_dict(json.loads(content))),
+        'decode_us': bench(args.number, lambda: Entry.from_dict(json.loads(content))),
+        'legacy_encode_us': bench(args.number, lambda: json.dumps(legacy.to_dict())),
+        'encode_us': bench(args.number, lambda: json.dumps(entry.to_dict())),
+    }
+    results['decode_speedup'] = results['legacy_decode_us'] / results['decode_us']
+    results['encode_speedup'] = results['legacy_encode_us'] / results['encode_us']
+
+    print(json.dumps({'media': args.media, **results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
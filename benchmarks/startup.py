@@ -0,0 +1,104 @@
+"""
+CLI startup time and import-time breakdown for each command.
+
+Run from the repository root:
+
+    python -m benchmarks.startup [--entries 1000] [--runs 10]
+
+Prints wall time and the cumulative import time of the top-level modules
+loaded by each command. Exits with a non-zero status if a command imports
+a module it should not need.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.fixtures import make_diary
+
+COMMANDS = {
+    'help': ['--help'],
+    'media help': ['media', '--help'],
+    'view': ['view', '1'],
+    'list': ['list'],
+    'tags': ['tags'],
+    'search': ['search', 'entry'],
+}
+# Modules that must stay out of the import graph of a command.
+FORBIDDEN_IMPORTS = {
+    'help': ['diary.entries', 'diary.media.cli', 'diary.media.entries', 'diary.utils.editing'],
+    'media help': ['diary.entries', 'diary.media.entries', 'diary.utils.editing'],
+    'view': ['diary.media.cli', 'diary.media.entries'],
+    'tags': ['diary.media.cli', 'diary.media.entries'],
+}
+
+
+def parse_import_times(stderr: str) -> dict[str, int]:
+    """Get cumulative import times in microseconds for modules imported at the top level."""
+
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def profile_command(args: list[str], env: dict, runs: int) -> dict:
+    command = [sys.executable, '-m', 'diary', *args]
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'diary', *args],
+        env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    all_imports = {
+        line.rsplit('|', 1)[-1].strip()
+        for line in result.stderr.splitlines() if line.startswith('import time:')
+    }
+    import_times = parse_import_times(result.stderr)
+
+    return {
+        'median_ms': statistics.median(timings),
+        'import_ms': {name: us / 1000 for name, us in sorted(import_times.items(), key=lambda i: -i[1])},
+        'diary_modules': sorted(m for m in all_imports if m.startswith('diary')),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home, PAGER='cat')
+        make_diary(Path(home), args.entries)
+        subprocess.run([sys.executable, '-m', 'diary', 'reindex'], env=env, check=True, stdout=subprocess.DEVNULL)
+
+        results = {name: profile_command(command, env, args.runs) for name, command in COMMANDS.items()}
+
+    violations = {
+        name: [m for m in FORBIDDEN_IMPORTS.get(name, []) if m in result['diary_modules']]
+        for name, result in results.items()
+    }
+    violations = {name: modules for name, modules in violations.items() if modules}
+
+    print(json.dumps({'entries': args.entries, 'commands': results, 'violations': violations}, indent=2))
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Benchmark suite for the diary storage and command functions.
+
+Generates synthetic diaries of each size under a temporary home directory
+and times the functions behind the CLI commands with cold and warm diary caches.
+Cold runs remove the metadata index, name and completion caches before every call;
+the OS page cache is not dropped. Run from the repository root:
+
+    python -m benchmarks.suite [--sizes 1000 10000 100000] [--runs 5] [--output results.json]
+    python -m benchmarks.suite --compare old.json new.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.fixtures import make_diary, entry_name, MEDIA_FILE_SIZE
+
+WORKER_ENV_VAR = 'DIARY_BENCH_WORKER'
+
+
+def get_cases(entry_count: int, media_file: str) -> dict:
+    # imported here, so that the worker process picks up its own HOME
+    from diary import config
+    from diary.entries import list_entries, list_entry_tags, view_entry
+    from diary.media.entries import add_entry_media
+    from diary.utils.cli import get_name, complete_date
+    from diary.utils.entries import get_metadata_path, upsert_metadata
+    from diary.utils.models import Entry
+
+    middle = entry_name(entry_count // 2)
+    metadata_path = str(get_metadata_path(middle))
+
+    return {
+        'list_entries': lambda: list_entries(tags=(), pages=False, no_return=True),
+        'list_entries_tag': lambda: list_entries(tags=('travel',), pages=False, no_return=True),
+        'list_entry_tags': lambda: list_entry_tags(counts=True),
+        'view_entry': lambda: view_entry(entry_name=middle, short=False),
+        'get_name': lambda: get_name(entry_count // 2),
+        'complete_date': lambda: complete_date(None, None, middle[:7]),
+        'upsert_metadata': lambda: upsert_metadata(metadata_path, Entry(tags=['bench'])),
+        'add_entry_media': lambda: add_entry_media(entry_name=middle, file_paths=[media_file]),
+    }, [config.INDEX_PATH, config.NAMES_CACHE_PATH, config.COMPLETION_CACHE_PATH]
+
+
+def time_call(func) -> float:
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        func()
+        return (time.perf_counter() - start) * 1000
+
+
+def run_worker(entry_count: int, runs: int, media_file: str) -> dict:
+    cases, cache_paths = get_cases(entry_count, media_file)
+
+    results = {}
+    for name, func in cases.items():
+        cold = []
+        for _ in range(runs):
+            for path in cache_paths:
+                path.unlink(missing_ok=True)
+            cold.append(time_call(func))
+
+        warm = [time_call(func) for _ in range(runs)]
+        results[name] = {'cold_ms': statistics.median(cold), 'warm_ms': statistics.median(warm)}
+    return results
+
+
+def run_size(entry_count: int, runs: int) -> dict:
+    with tempfile.TemporaryDirectory() as home:
+        start = time.perf_counter()
+        make_diary(Path(home), entry_count)
+        generate_s = time.perf_counter() - start
+
+        media_file = Path(home) / 'photo.jpg'
+        media_file.write_bytes(os.urandom(MEDIA_FILE_SIZE))
+
+        env = dict(os.environ, HOME=home, **{WORKER_ENV_VAR: '1'})
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.suite', '--sizes', str(entry_count),
+             '--runs', str(runs), '--media-file', str(media_file)],
+            env=env, check=True, stdout=subprocess.PIPE, text=True,
+        ).stdout
+
+    return {'generate_s': generate_s, 'functions': json.loads(output)}
+
+
+def get_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    for size, result in new['results'].items():
+        old_functions = old['results'].get(size, {}).get('functions', {})
+        for name, timings in result['functions'].items():
+            for kind, ms in timings.items():
+                if (old_ms := old_functions.get(name, {}).get(kind)) is None:
+                    continue
+                print(f'{size:>7} {name:<18} {kind:<8} {old_ms:10.3f} -> {ms:10.3f} ms  x{ms / old_ms:.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help='write results to this file instead of stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    parser.add_argument('--media-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if os.environ.get(WORKER_ENV_VAR):
+        print(json.dumps(run_worker(args.sizes[0], args.runs, args.media_file)))
+        return
+
+    report = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': args.runs,
+        'results': {str(size): run_size(size, args.runs) for size in args.sizes},
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
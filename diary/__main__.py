@@ -0,0 +1,33 @@
+import os
+import sys
+
+from diary import locations
+
+
+def main():
+    if instruction := os.environ.get(locations.COMPLETE_ENV_VAR):
+        from diary.complete import fast_complete, load_completion_cache
+
+        if fast_complete(instruction):
+            sys.exit(0)
+        if load_completion_cache() is None and os.path.isdir(locations.DATA_DIR):
+            # the cache is outdated, for example by a change of diary.config that no entry change follows,
+            # so it is saved again for the next completion to take the fast path
+            from diary.utils.entries import get_index
+            from diary.utils.index import save_completion_cache
+
+            save_completion_cache(get_index())
+
+    if os.path.exists(locations.SOCKET_PATH):
+        from diary.client import forward_command
+
+        if (status := forward_command(sys.argv[1:])) is not None:
+            sys.exit(status)
+
+    from diary.cli import cli
+
+    cli(prog_name=locations.PROGNAME)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+"""
+Whole-diary export and import.
+
+Entries are streamed one file at a time through a tar archive laid out as
+`diary/<entry>/entry.txt`, `diary/<entry>/meta.json` and `diary/<entry>/media/<file>`,
+so memory use does not grow with the size of the diary. Media files with the same digest
+in entry metadata are stored once and referenced by tar hard links. Compression is done by `pigz` or `zstd`
+in a separate process using all cores when they are installed, with gzip from the standard
+library as the fallback.
+"""
+import bisect
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import threading
+from datetime import date
+from contextlib import contextmanager
+from pathlib import Path, PurePosixPath
+
+import click
+
+from diary import config
+from diary.utils.entries import (
+    get_entry_media_path, get_metadata_path, get_metadata, save_metadata, entry_exists, create_entry,
+)
+from diary.utils.journal import metadata_batch
+from diary.utils.layout import get_entry_dir, note_entry_change
+from diary.utils.models import Entry
+from diary.utils.names import get_sorted_entry_names
+from diary.utils.storage import get_storage, DIRECTORY
+from diary.utils.trace import span
+from diary.media.store import store_blob_stream, link_blob, add_refs, release_refs
+
+ARCHIVE_ROOT = 'diary'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def _get_compressor(compression: str) -> list[str] | None:
+    if compression == 'zstd':
+        if not (zstd := shutil.which('zstd')):
+            raise ArchiveError('zstd compression requires the zstd program')
+        return [zstd, '-q', '-T0', '-c']
+    if compression == 'gzip' and (pigz := shutil.which('pigz')):
+        return [pigz, '-c']
+    return None
+
+
+@contextmanager
+def _open_output(path: str):
+    if path == '-':
+        yield sys.stdout.buffer
+        return
+    with open(path, 'wb') as f:
+        yield f
+
+
+@contextmanager
+def _archive_writer(path: str, compression: str):
+    command = _get_compressor(compression)
+    with _open_output(path) as output:
+        if command is None:
+            mode = 'w|gz' if compression == 'gzip' else 'w|'
+            with tarfile.open(fileobj=output, mode=mode) as tar:
+                yield tar
+            return
+
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=output)
+        try:
+            with tarfile.open(fileobj=process.stdin, mode='w|') as tar:
+                yield tar
+        finally:
+            process.stdin.close()
+            if process.wait() != 0:
+                raise ArchiveError(f'{command[0]} exited with status {process.returncode}')
+
+
+def _get_exported_names(since: str = None) -> list[str]:
+    names = get_sorted_entry_names()
+    if since is not None:
+        names = names[bisect.bisect_left(names, since):]
+    return names
+
+
+def _add_stored_entry_files(tar: tarfile.TarFile, entry_name: str):
+    storage = get_storage()
+    text_stat = storage.stat_text(entry_name)
+    parts = (
+        (config.ENTRY_FILE_NAME, storage.read_text(entry_name)),
+        (config.METADATA_FILE_NAME, storage.read_metadata(entry_name)),
+    )
+    for file_name, content in parts:
+        if content is None:
+            continue
+        content = content.encode()
+        info = tarfile.TarInfo(f'{ARCHIVE_ROOT}/{entry_name}/{file_name}')
+        info.size = len(content)
+        info.mtime = text_stat[0] // 10**9 if text_stat else 0
+        info.mode = 0o644
+        tar.addfile(info, io.BytesIO(content))
+
+
+def _add_media_file(tar: tarfile.TarFile, file_path: Path, arcname: str, digest: str | None, members: dict):
+    """Add a media file, or a hard link to the member already holding its blob."""
+
+    stat = file_path.stat()
+    info = tarfile.TarInfo(arcname)
+    info.mtime = stat.st_mtime
+    info.mode = 0o644
+
+    # a file edited outside of diary no longer matches its digest, the size catches most such edits
+    if digest and (first := members.get(digest)) and first[1] == stat.st_size:
+        info.type = tarfile.LNKTYPE
+        info.linkname = first[0]
+        tar.addfile(info)
+        return
+
+    info.size = stat.st_size
+    with open(file_path, 'rb') as f:
+        tar.addfile(info, f)
+    if digest:
+        members[digest] = (arcname, stat.st_size)
+
+
+def _add_entry_files(tar: tarfile.TarFile, entry_name: str, members: dict) -> int:
+    entry_dir = get_entry_dir(entry_name)
+    arc_dir = f'{ARCHIVE_ROOT}/{entry_name}'
+
+    if get_storage().name == DIRECTORY and entry_dir.exists():
+        for file_name in (config.ENTRY_FILE_NAME, config.METADATA_FILE_NAME):
+            if (entry_dir / file_name).is_file():
+                tar.add(entry_dir / file_name, arcname=f'{arc_dir}/{file_name}', recursive=False)
+    else:
+        # packed entries and other storage backends
+        _add_stored_entry_files(tar, entry_name)
+
+    media_path = entry_dir / config.MEDIA_SUBDIR_NAME
+    if not media_path.is_dir():
+        return 0
+
+    metadata = get_metadata(entry_name=entry_name) or Entry()
+    digests = {m.file_name: m.digest for m in metadata.media}
+    media_count = 0
+    for file_path in sorted(media_path.iterdir()):
+        if file_path.name.startswith('.') or not file_path.is_file():
+            continue
+        arcname = f'{arc_dir}/{config.MEDIA_SUBDIR_NAME}/{file_path.name}'
+        _add_media_file(tar, file_path, arcname, digests.get(file_path.name), members)
+        media_count += 1
+    return media_count
+
+
+def export_entries(path: str, compression: str, since: str = None):
+    names = _get_exported_names(since=since)
+
+    media_count = 0
+    # digest -> archive name and size of the first media file with that digest
+    members = {}
+    try:
+        with span('archive.export'), _archive_writer(path, compression=compression) as tar:
+            for entry_name in names:
+                media_count += _add_entry_files(tar, entry_name, members)
+    except (ArchiveError, OSError) as e:
+        click.echo(f'Could not export entries: {e}', err=True)
+        return
+
+    click.echo(f'Exported {len(names)} entries with {media_count} media files.', err=True)
+
+
+def _feed(source, pipe):
+    try:
+        shutil.copyfileobj(source, pipe)
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            pipe.close()
+        except BrokenPipeError:
+            pass
+
+
+@contextmanager
+def _archive_reader(path: str):
+    with open(path, 'rb') if path != '-' else open(sys.stdin.fileno(), 'rb', closefd=False) as f:
+        if f.peek(len(ZSTD_MAGIC))[:len(ZSTD_MAGIC)] != ZSTD_MAGIC:
+            with tarfile.open(fileobj=f, mode='r|*') as tar:
+                yield tar
+            return
+
+        if not (zstd := shutil.which('zstd')):
+            raise ArchiveError('zstd compressed archives require the zstd program')
+        # the peeked bytes are buffered here, so the input is fed to zstd through a pipe
+        process = subprocess.Popen([zstd, '-q', '-dc'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        feeder = threading.Thread(target=_feed, args=(f, process.stdin), daemon=True)
+        feeder.start()
+        try:
+            with tarfile.open(fileobj=process.stdout, mode='r|') as tar:
+                yield tar
+        finally:
+            process.stdout.close()
+            process.wait()
+            feeder.join()
+
+
+def _is_entry_name(name: str) -> bool:
+    try:
+        date.fromisoformat(name)
+    except ValueError:
+        return False
+    return True
+
+
+def _parse_member_path(member: tarfile.TarInfo) -> tuple[str, str, str | None] | None:
+    """Split an archive path into entry name, file kind and media file name, None for unknown paths."""
+
+    parts = PurePosixPath(member.name).parts
+    if len(parts) < 3 or parts[0] != ARCHIVE_ROOT or not _is_entry_name(parts[1]):
+        return None
+
+    if len(parts) == 3 and parts[2] in (config.ENTRY_FILE_NAME, config.METADATA_FILE_NAME):
+        return parts[1], parts[2], None
+    if len(parts) == 4 and parts[2] == config.MEDIA_SUBDIR_NAME and not parts[3].startswith('.'):
+        return parts[1], parts[2], parts[3]
+    return None
+
+
+def _write_stream(stream, dest_path: Path):
+    tmp_path = dest_path.with_name(f'.{dest_path.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            shutil.copyfileobj(stream, f)
+        os.replace(tmp_path, dest_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+class _EntryImport:
+    """Files of one entry read from the archive, saved to metadata once the entry is complete."""
+
+    def __init__(self, entry_name: str):
+        self.entry_name = entry_name
+        self.metadata = None
+        self.digests = {}
+
+    def finish(self) -> list[str]:
+        metadata = self.metadata or get_metadata(entry_name=self.entry_name) or Entry()
+        for media in metadata.media:
+            if media.file_name in self.digests:
+                media.digest = self.digests[media.file_name]
+
+        metadata_path = get_metadata_path(entry_name=self.entry_name, create=True)
+        save_metadata(str(metadata_path), metadata)
+        note_entry_change(self.entry_name)
+        return [m.digest for m in metadata.media if m.file_name in self.digests]
+
+
+def _replace_entry(entry_name: str):
+    metadata = get_metadata(entry_name=entry_name) or Entry()
+    get_storage().delete(entry_name)
+    release_refs([m.digest for m in metadata.media])
+
+
+def import_entries(path: str, overwrite: bool = False):
+    imported = set()
+    skipped = set()
+    ignored = 0
+    media_count = 0
+    refs = []
+    digests_by_member = {}
+    current = None
+
+    try:
+        with span('archive.import'), metadata_batch(), _archive_reader(path) as tar:
+            for member in tar:
+                parsed = _parse_member_path(member)
+                if parsed is None or not (member.isfile() or member.islnk()):
+                    ignored += 1
+                    continue
+
+                entry_name, kind, media_name = parsed
+                if entry_name in skipped:
+                    continue
+                if current is None or current.entry_name != entry_name:
+                    if current is not None:
+                        refs.extend(current.finish())
+                    if entry_name not in imported and entry_exists(entry_name):
+                        if not overwrite:
+                            skipped.add(entry_name)
+                            current = None
+                            continue
+                        _replace_entry(entry_name)
+                    imported.add(entry_name)
+                    current = _EntryImport(entry_name)
+
+                if kind == config.MEDIA_SUBDIR_NAME:
+                    if member.islnk():
+                        digest = digests_by_member.get(member.linkname)
+                        if digest is None:
+                            ignored += 1
+                            continue
+                    else:
+                        digest = store_blob_stream(tar.extractfile(member))
+                    digests_by_member[member.name] = digest
+                    media_path = get_entry_media_path(entry_name=entry_name, create=True)
+                    link_blob(digest, str(media_path / media_name))
+                    current.digests[media_name] = digest
+                    media_count += 1
+                elif member.isfile() and kind == config.METADATA_FILE_NAME:
+                    content = tar.extractfile(member).read()
+                    current.metadata = Entry.from_dict(json.loads(content) if content else {})
+                elif member.isfile():
+                    create_entry(entry_name)
+                    stream = tar.extractfile(member)
+                    if (entry_path := get_storage().get_text_file(entry_name)) is not None:
+                        _write_stream(stream, entry_path)
+                    else:
+                        get_storage().write_text(entry_name, stream.read().decode())
+
+            if current is not None:
+                refs.extend(current.finish())
+    except (ArchiveError, tarfile.TarError, OSError, ValueError, TypeError) as e:
+        click.echo(f'Could not import entries: {e}')
+    finally:
+        add_refs(refs)
+
+    click.echo(f'Imported {len(imported)} entries with {media_count} media files.')
+    if skipped:
+        click.echo(f'Skipped {len(skipped)} existing entries, use --overwrite to replace them.')
+    if ignored:
+        click.echo(f'Ignored {ignored} unknown archive members.')
@@ -0,0 +1,233 @@
+"""
+Bulk entry changes from JSON lines.
+
+Every line is one operation on an entry, for example:
+
+    {"op": "title", "entry": "2024-05-17", "title": "Hiking"}
+    {"op": "tag", "entry": "2024-05-17", "tags": ["travel", "mountains"]}
+    {"op": "untag", "entry": "2024-05-17", "tags": ["draft"]}
+    {"op": "media", "entry": "2024-05-17", "path": "photos/top.jpg", "name": "top", "description": "The view"}
+
+Operations are grouped by entry and applied in input order to metadata read once,
+so each entry gets a single metadata write inside one `metadata_batch`.
+Entries are processed concurrently, missing entries are created like `diary write` does
+when at least one of their operations passes the checks.
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date
+from pathlib import Path
+
+import click
+
+from diary import config
+from diary.utils.entries import (
+    create_entry, get_metadata_path, get_entry_media_path, read_metadata_file, save_metadata, update_media_metadata,
+)
+from diary.utils.journal import metadata_batch
+from diary.utils.layout import note_entry_change
+from diary.utils.models import MediaEntry, Entry
+from diary.media.store import store_blob, link_blob, add_refs, release_refs
+
+TITLE = 'title'
+TAG = 'tag'
+UNTAG = 'untag'
+MEDIA = 'media'
+OPERATIONS = (TITLE, TAG, UNTAG, MEDIA)
+
+
+class OperationError(Exception):
+    pass
+
+
+@dataclass(slots=True)
+class Operation:
+    line: int
+    op: str
+    entry_name: str
+    data: dict
+
+
+@dataclass(slots=True)
+class EntryResult:
+    errors: dict[int, str] = field(default_factory=dict)
+    added: list[str] = field(default_factory=list)
+    replaced: list[str] = field(default_factory=list)
+
+
+def _get_string(data: dict, key: str, required: bool = True) -> str | None:
+    value = data.get(key)
+    if value is None and not required:
+        return None
+    if not isinstance(value, str) or not value:
+        raise OperationError(f'{key!r} must be a non-empty string')
+    return value
+
+
+def _get_tags(data: dict) -> list[str]:
+    tags = data.get('tags', data.get('tag'))
+    if isinstance(tags, str):
+        tags = [tags]
+    if not tags or not isinstance(tags, list) or not all(isinstance(t, str) and t for t in tags):
+        raise OperationError("'tags' must be a tag or a list of tags")
+    return tags
+
+
+def parse_operation(line: int, text: str) -> Operation:
+    try:
+        data = json.loads(text)
+    except ValueError:
+        raise OperationError('not a JSON object')
+    if not isinstance(data, dict):
+        raise OperationError('not a JSON object')
+
+    if (op := data.get('op')) not in OPERATIONS:
+        raise OperationError(f"'op' must be one of {', '.join(OPERATIONS)}")
+    try:
+        entry_name = str(date.fromisoformat(_get_string(data, 'entry')))
+    except ValueError:
+        raise OperationError("'entry' must be a date (Y-M-D)")
+
+    if op == TITLE:
+        _get_string(data, 'title')
+    elif op in (TAG, UNTAG):
+        _get_tags(data)
+    else:
+        _get_string(data, 'path')
+        _get_string(data, 'name', required=False)
+        _get_string(data, 'description', required=False)
+    return Operation(line=line, op=op, entry_name=entry_name, data=data)
+
+
+def _attach_media(entry_name: str, metadata: Entry, data: dict, result: EntryResult):
+    media_path = get_entry_media_path(entry_name=entry_name, create=True)
+    if media_path is None:
+        raise OperationError(f'could not add files to {config.DATA_DIR}, check access')
+
+    src_path = Path(data['path'])
+    file_name = ''.join([data['name'], *src_path.suffixes]) if data.get('name') else src_path.name
+    try:
+        digest = store_blob(str(src_path))
+        link_blob(digest, str(media_path / file_name))
+    except OSError as e:
+        raise OperationError(f'could not copy {src_path}: {e.strerror}')
+    note_entry_change(entry_name)
+
+    result.replaced.extend(m.digest for m in metadata.media if m.file_name == file_name)
+    result.added.append(digest)
+    metadata.media = update_media_metadata(
+        current=metadata.media,
+        update=[MediaEntry(file_name=file_name, description=data.get('description'), digest=digest)],
+    )
+
+
+def _check_operation(operation: Operation):
+    """Check what parsing cannot, before the entry is created for the operation."""
+
+    if operation.op == MEDIA:
+        src_path = operation.data['path']
+        if not os.path.isfile(src_path) or not os.access(src_path, os.R_OK):
+            raise OperationError(f'could not copy {src_path}: not a readable file')
+
+
+def _apply_operations(entry_name: str, operations: list[Operation]) -> EntryResult:
+    result = EntryResult()
+    valid = []
+    for operation in operations:
+        try:
+            _check_operation(operation)
+        except OperationError as e:
+            result.errors[operation.line] = str(e)
+        else:
+            valid.append(operation)
+    if not valid:
+        return result
+
+    metadata_path = get_metadata_path(entry_name=entry_name, create=True) if create_entry(entry_name) else None
+    if metadata_path is None:
+        result.errors.update({o.line: f'could not edit metadata in {config.DATA_DIR}, check access' for o in valid})
+        return result
+
+    metadata = read_metadata_file(str(metadata_path))
+    for operation in valid:
+        data = operation.data
+        try:
+            if operation.op == TITLE:
+                metadata.title = data['title']
+            elif operation.op == TAG:
+                metadata.tags = list(dict.fromkeys([*metadata.tags, *_get_tags(data)]))
+            elif operation.op == UNTAG:
+                removed = set(_get_tags(data))
+                metadata.tags = [t for t in metadata.tags if t not in removed]
+            else:
+                _attach_media(entry_name, metadata, data, result)
+        except OperationError as e:
+            result.errors[operation.line] = str(e)
+
+    if any(o.line not in result.errors for o in valid):
+        save_metadata(str(metadata_path), metadata)
+    return result
+
+
+def _echo_result(operation: Operation | None, line: int, error: str | None):
+    result = {'line': line}
+    if operation is not None:
+        result.update(op=operation.op, entry=operation.entry_name)
+    result.update(ok=error is None)
+    if error is not None:
+        result['error'] = error
+    click.echo(json.dumps(result))
+
+
+def run_batch(lines, workers: int = config.BATCH_WORKERS):
+    """Apply the operations read from lines and print one JSON result per operation."""
+
+    start = time.perf_counter()
+    operations = {}
+    errors = {}
+    by_entry: dict[str, list[Operation]] = {}
+    for line, text in enumerate(lines, start=1):
+        if not text.strip():
+            continue
+        try:
+            operation = parse_operation(line, text)
+        except OperationError as e:
+            errors[line] = str(e)
+            continue
+        operations[line] = operation
+        by_entry.setdefault(operation.entry_name, []).append(operation)
+
+    added = []
+    replaced = []
+    with metadata_batch(), ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            entry_name: executor.submit(_apply_operations, entry_name, entry_operations)
+            for entry_name, entry_operations in by_entry.items()
+        }
+        for entry_name, future in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                errors.update({o.line: f'could not update entry: {e}' for o in by_entry[entry_name]})
+                continue
+            errors.update(result.errors)
+            added.extend(result.added)
+            replaced.extend(result.replaced)
+
+    add_refs(added)
+    release_refs(replaced)
+
+    line_numbers = sorted(operations.keys() | errors.keys())
+    for line in line_numbers:
+        _echo_result(operations.get(line), line=line, error=errors.get(line))
+
+    seconds = time.perf_counter() - start
+    total = len(line_numbers)
+    click.echo(
+        f'Applied {total - len(errors)} of {total} operations on {len(by_entry)} entries '
+        f'in {seconds:.2f}s ({total / seconds if seconds else 0:.0f} operations/s).',
+        err=True,
+    )
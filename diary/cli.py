@@ -1,17 +1,15 @@
-from datetime import date
+from datetime import date, datetime
 
 import click
 
 from diary import config
-from diary.entries import (
-    edit_entry, list_entries, add_metadata, list_entry_tags, view_entry,
-    delete_entry,
-)
-from diary.media.cli import media
-from diary.utils.cli import today, get_name, complete_date
-from diary.entries import update_entry_meta
+from diary.utils.cli import today, get_name, complete_date, complete_tag
+from diary.utils.lazy import LazyGroup
 from diary.types import ENTRY_REF
 
+# Command implementations are imported inside the commands,
+# so that each invocation only loads the modules it needs.
+
 
 entry_argument = click.argument(
     config.ENTRY_REF_VARNAME,
@@ -37,8 +35,11 @@ entry_argument = click.argument(
     multiple=True,
     help='Add tags to the entry (accepting one or more).',
     metavar=config.TAG_OPTION_METAVAR,
+    shell_complete=complete_tag,
 )
 def write(entry: date | int, name: str, tag: tuple[str]):
+    from diary.entries import edit_entry, add_metadata
+
     entry_name = get_name(entry)
     edit_entry(entry_name)
     if name or tag:
@@ -52,17 +53,34 @@ def write(entry: date | int, name: str, tag: tuple[str]):
     is_flag=True,
     help='Truncate entry for brevity.',
 )
-def view(entry: date | int, short: bool):
+@click.option(
+    '-n', '--lines',
+    type=click.IntRange(min=1),
+    help='Show only the first N lines of the entry.',
+    metavar='N',
+)
+@click.option(
+    '--tail',
+    type=click.IntRange(min=1),
+    help='Show only the last N lines of the entry.',
+    metavar='N',
+)
+def view(entry: date | int, short: bool, lines: int, tail: int):
     """View entry."""
+    from diary.entries import view_entry
+
+    if sum(map(bool, (short, lines, tail))) > 1:
+        raise click.UsageError('--short, --lines and --tail are mutually exclusive.')
 
     entry_name = get_name(entry)
-    view_entry(entry_name=entry_name, short=short)
+    view_entry(entry_name=entry_name, short=short, lines=lines, tail=tail)
 
 
 @click.command(name='edit-meta')
 @entry_argument
 def edit_meta(entry: date | int):
     """Edit entry metadata."""
+    from diary.entries import update_entry_meta
 
     entry_name = get_name(entry)
     update_entry_meta(entry_name=entry_name)
@@ -75,6 +93,13 @@ def edit_meta(entry: date | int):
     multiple=True,
     help='List entries with any of these tags (accepting one or more).',
     metavar='TAG',
+    shell_complete=complete_tag,
+)
+@click.option(
+    '-q', '--query',
+    type=click.STRING,
+    help='List entries matching a tag query, e.g. "work AND (travel OR conf) AND NOT draft".',
+    metavar='QUERY',
 )
 @click.option(
     '-p', '--pages',
@@ -86,10 +111,95 @@ def edit_meta(entry: date | int):
     is_flag=True,
     help='Choose an entry to edit.',
 )
-def list_(tag: tuple[str], pages: bool, edit: bool):
+@click.option(
+    '-l', '--limit',
+    type=click.IntRange(min=1),
+    help='List at most this many entries.',
+)
+@click.option(
+    '-o', '--offset',
+    type=click.IntRange(min=0),
+    default=0,
+    help='Skip this many most recent entries.',
+)
+@click.option(
+    '--since',
+    type=click.DateTime(formats=['%Y-%m-%d']),
+    help='List entries from this date on.',
+)
+@click.option(
+    '--until',
+    type=click.DateTime(formats=['%Y-%m-%d']),
+    help='List entries up to this date.',
+)
+@click.option(
+    '--month',
+    type=click.DateTime(formats=['%Y-%m']),
+    help='List entries of a month (Y-M).',
+)
+@click.option(
+    '--year',
+    type=click.IntRange(min=1, max=9999),
+    help='List entries of a year.',
+)
+def list_(
+        tag: tuple[str],
+        query: str,
+        pages: bool,
+        edit: bool,
+        limit: int,
+        offset: int,
+        since: datetime,
+        until: datetime,
+        month: datetime,
+        year: int,
+):
     """List existing entries."""
+    from diary.entries import list_entries, edit_entry
+    from diary.utils.query import parse_query, QuerySyntaxError
+
+    try:
+        parsed_query = parse_query(query) if query is not None else None
+    except QuerySyntaxError as e:
+        raise click.BadParameter(str(e), param_hint="'-q' / '--query'")
+
+    # entry names are ISO dates, so date ranges are compared as strings
+    bounds = [(since and since.strftime('%Y-%m-%d'), until and until.strftime('%Y-%m-%d'))]
+    if month:
+        bounds.append((month.strftime('%Y-%m-01'), month.strftime('%Y-%m-31')))
+    if year:
+        bounds.append((f'{year:04}-01-01', f'{year:04}-12-31'))
+    since_name = max((b[0] for b in bounds if b[0]), default=None)
+    until_name = min((b[1] for b in bounds if b[1]), default=None)
+
+    entries_map = list_entries(
+        tags=tag,
+        pages=pages,
+        no_return=(not edit),
+        limit=limit,
+        offset=offset,
+        since=since_name,
+        until=until_name,
+        query=parsed_query,
+    )
+    if entries_map:
+        entry_num = click.prompt('Entry # to edit', default=0)
+        if entry_num and (entry_name := entries_map.get(entry_num)):
+            edit_entry(entry_name=entry_name)
+
+
+@click.command(name='search')
+@click.argument('query', type=click.STRING)
+@click.option(
+    '-e', '--edit',
+    is_flag=True,
+    help='Choose an entry to edit.',
+)
+def search(query: str, edit: bool):
+    """Search entry texts."""
+    from diary.entries import search_entries, edit_entry
 
-    entries_map = list_entries(tags=tag, pages=pages, no_return=(not edit))
+    entries_map = search_entries(query=query, no_return=(not edit))
     if entries_map:
         entry_num = click.prompt('Entry # to edit', default=0)
         if entry_num and (entry_name := entries_map.get(entry_num)):
@@ -105,27 +215,180 @@ def list_(tag: tuple[str], pages: bool, edit: bool):
 )
 def delete(entry: date | int, yes: bool):
     """Delete an entry."""
+    from diary.entries import delete_entry
 
     entry_name = get_name(entry)
     delete_entry(entry_name=entry_name, do_not_prompt=yes)
 
 
 @click.command(name='tags')
-def list_tags():
+@click.option(
+    '-c', '--counts',
+    is_flag=True,
+    help='Show the number of entries for each tag.',
+)
+def list_tags(counts: bool):
     """List existing tags."""
+    from diary.entries import list_entry_tags
+
+    list_entry_tags(counts=counts)
+
+
+@click.command(name='stats')
+def stats():
+    """Show word counts, entries per month, writing streaks, tag frequencies and media volume."""
+    from diary.entries import show_stats
+
+    show_stats()
+
+
+@click.command(name='serve')
+def serve():
+    """
+    Keep entries, metadata and tags in memory and answer commands over a local socket.
+
+    While it runs, `list`, `tags`, `view`, entry numbers and shell completion are answered
+    by the daemon; without it every command reads the data directory itself.
+    """
+    from diary.server import run_server
+
+    run_server()
+
+
+@click.command(name='reindex')
+def reindex():
+    """Rebuild the entry metadata index."""
+    from diary.entries import reindex_entries
+
+    reindex_entries()
+
+
+@click.command(name='pack')
+@click.argument('year', type=click.IntRange(min=1, max=9999))
+def pack(year: int):
+    """
+    Pack the entries of a past YEAR into a single file.
+
+    Packed entries are read in place and unpacked when they are edited.
+    Entries with media files are not packed.
+    """
+    from diary.entries import pack_year
+
+    pack_year(year=year)
+
+
+@click.command(name='migrate-storage')
+@click.argument('backend', type=click.Choice(['directory', 'sqlite']))
+def migrate_storage(backend: str):
+    """Copy entries from the configured storage to the BACKEND storage."""
+    from diary.entries import migrate_entries
+
+    migrate_entries(backend=backend)
+
+
+@click.command(name='migrate-layout')
+@click.argument('layout', type=click.Choice(['flat', 'sharded']))
+def migrate_layout(layout: str):
+    """
+    Move entry directories to the flat or the sharded (year/month) LAYOUT.
+
+    Entries are moved one by one and stay readable during the migration.
+    """
+    from diary.entries import migrate_entry_layout
+
+    migrate_entry_layout(layout=layout)
+
+
+@click.command(name='batch')
+@click.argument('operations', type=click.File('r'), default='-')
+def batch(operations):
+    """
+    Apply entry changes from a file of JSON lines (stdin by default).
+
+    Each line is an operation on an entry: {"op": "title", "entry": "2024-05-17", "title": "..."},
+    "tag" and "untag" with "tags", or "media" with "path" and optional "name" and "description".
+    One JSON result is printed per operation.
+    """
+    from diary.batch import run_batch
+
+    run_batch(operations)
+
+
+@click.command(name='export')
+@click.argument('archive', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option(
+    '-c', '--compress',
+    type=click.Choice(['gzip', 'zstd', 'none']),
+    default='gzip',
+    show_default=True,
+    help='Compress the archive, using pigz or zstd on all cores when installed.',
+)
+@click.option(
+    '--since',
+    type=click.DateTime(formats=['%Y-%m-%d']),
+    help='Only export entries from this date on.',
+)
+def export(archive: str, compress: str, since: datetime):
+    """Export entries, metadata and media to a tar ARCHIVE (`-` for stdout)."""
+    from diary.archive import export_entries
+
+    export_entries(path=archive, compression=compress, since=since.date().isoformat() if since else None)
+
+
+@click.command(name='import')
+@click.argument('archive', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option(
+    '--overwrite',
+    is_flag=True,
+    help='Replace existing entries found in the archive.',
+)
+def import_(archive: str, overwrite: bool):
+    """Import entries from an exported ARCHIVE (`-` for stdin)."""
+    from diary.archive import import_entries
+
+    import_entries(path=archive, overwrite=overwrite)
+
+
+@click.group(
+    cls=LazyGroup,
+    help=config.ROOT_HELP,
+    lazy_subcommands={'media': 'diary.media.cli.media'},
+)
+@click.option(
+    '--profile',
+    is_flag=True,
+    help=f'Print a per-phase timing breakdown to stderr (or set {config.TRACE_ENV_VAR}).',
+)
+@click.option(
+    '--profile-output',
+    type=click.Path(dir_okay=False, writable=True),
+    help='Write the timings as a Chrome trace JSON file.',
+)
+def cli(profile: bool, profile_output: str):
+    if profile or profile_output:
+        from diary.utils.trace import enable
 
-    list_entry_tags()
+        enable(output=profile_output)
 
+    if config.JOURNAL_PATH.exists():
+        from diary.utils.journal import replay_journal
 
-@click.group(help=config.ROOT_HELP)
-def cli():
-    pass
+        replay_journal()
 
 
 cli.add_command(write)
 cli.add_command(list_)
+cli.add_command(search)
 cli.add_command(list_tags)
+cli.add_command(stats)
 cli.add_command(view)
 cli.add_command(edit_meta)
 cli.add_command(delete)
-cli.add_command(media)
+cli.add_command(reindex)
+cli.add_command(serve)
+cli.add_command(pack)
+cli.add_command(migrate_storage)
+cli.add_command(migrate_layout)
+cli.add_command(batch)
+cli.add_command(export)
+cli.add_command(import_)
@@ -0,0 +1,94 @@
+"""
+Client side of the resident daemon (`diary serve`).
+
+`list`, `tags` and `view`, entry number resolution and shell completion are forwarded
+to the daemon over `locations.SOCKET_PATH`. Like `diary.complete`, this module is used
+before click is imported. Every function returns None when there is no daemon to answer,
+so the caller falls back to reading the data directory itself.
+"""
+import json
+import os
+import socket
+import sys
+
+from diary import locations
+
+FORWARDED_COMMANDS = {'list', 'tags', 'view'}
+FORWARDED_ENV_VARS = (locations.DATE_ENV_VAR, locations.STORAGE_ENV_VAR)
+
+_forwarding = True
+
+
+def disable_forwarding():
+    """Answer everything in this process, used by the daemon itself."""
+
+    global _forwarding
+    _forwarding = False
+
+
+def request(message: dict) -> dict | None:
+    if not _forwarding or not os.path.exists(locations.SOCKET_PATH):
+        return None
+
+    chunks = []
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(locations.SERVE_TIMEOUT)
+            sock.connect(locations.SOCKET_PATH)
+            sock.sendall(json.dumps(message).encode() + b'\n')
+            sock.shutdown(socket.SHUT_WR)
+            while chunk := sock.recv(64 * 1024):
+                chunks.append(chunk)
+        response = json.loads(b''.join(chunks))
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(response, dict) or response.get('fallback'):
+        return None
+    return response
+
+
+def is_forwardable(args: list[str]) -> bool:
+    """Check that a command line runs a read-only command that does not need the terminal."""
+
+    if not args or args[0] not in FORWARDED_COMMANDS:
+        return False
+    # choosing an entry to edit needs the terminal
+    return args[0] != locations.LIST_CMDNAME or not any(
+        a == '--edit' or (a.startswith('-') and not a.startswith('--') and 'e' in a) for a in args[1:]
+    )
+
+
+def forward_command(args: list[str]) -> int | None:
+    """Run a command in the daemon and print its output, return the exit status."""
+
+    if not is_forwardable(args) or os.environ.get(locations.TRACE_ENV_VAR):
+        return None
+
+    response = request({
+        'argv': args,
+        'env': {name: os.environ.get(name) for name in FORWARDED_ENV_VARS},
+        'color': sys.stdout.isatty(),
+    })
+    if response is None:
+        return None
+
+    sys.stderr.write(response['errors'])
+    if response['paged'] and sys.stdout.isatty():
+        import click
+
+        click.echo_via_pager(response['output'], color=True)
+    else:
+        sys.stdout.write(response['output'])
+        sys.stdout.flush()
+    return response['status']
+
+
+def resolve_entry_number(number: int) -> str | None:
+    response = request({'name': number})
+    return response['name'] if response else None
+
+
+def request_completions(args: list[str], incomplete: str) -> list[str] | None:
+    response = request({'complete': args, 'incomplete': incomplete})
+    return response['completions'] if response else None
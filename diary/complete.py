@@ -0,0 +1,237 @@
+"""
+Fast path for shell completion.
+
+Answers completion requests for entry dates, tags and entry media files
+from the completion cache without importing click or the CLI modules.
+Anything it does not know how to answer is left to the regular click completion.
+"""
+import marshal
+import os
+import sys
+
+from diary import locations
+from diary.utils.memo import memoized_load
+
+ENTRY = 'entry'
+TAG = 'tag'
+FILE = 'file'
+FLAG = 'flag'
+
+_ENTRY_OPTIONS = {'-e': ENTRY, '--entry': ENTRY}
+
+# Mirrors the commands in diary.cli: options and positional arguments
+# that are completed here. Unlisted values are left to click.
+COMMANDS = {
+    'write': {'options': {'-n': None, '--name': None, '-t': TAG, '--tag': TAG}, 'args': [ENTRY]},
+    'view': {'options': {'-s': FLAG, '--short': FLAG, '-n': None, '--lines': None, '--tail': None}, 'args': [ENTRY]},
+    'edit-meta': {'options': {}, 'args': [ENTRY]},
+    'delete': {'options': {'-y': FLAG, '--yes': FLAG}, 'args': [ENTRY]},
+    'list': {
+        'options': {
+            '-t': TAG, '--tag': TAG, '-q': None, '--query': None, '-p': FLAG, '--pages': FLAG, '-e': FLAG, '--edit': FLAG,
+            '-l': None, '--limit': None, '-o': None, '--offset': None,
+            '--since': None, '--until': None, '--month': None, '--year': None,
+        },
+        'args': [],
+    },
+    'media': {'commands': {
+        'view': {'options': _ENTRY_OPTIONS, 'args': [FILE]},
+        'edit': {'options': _ENTRY_OPTIONS, 'args': [FILE]},
+        'edit-meta': {'options': _ENTRY_OPTIONS, 'args': [FILE]},
+        'delete': {'options': _ENTRY_OPTIONS, 'args': [FILE]},
+    }},
+}
+
+SHELL_FORMATS = {
+    'bash': '{type},{value}',
+    'zsh': '{type}\n{value}\n_',
+    'fish': '{type},{value}',
+}
+
+
+def split_words(line: str) -> list[str]:
+    if any(c in line for c in '\'"\\'):
+        import shlex
+
+        return shlex.split(line)
+    return line.split()
+
+
+def get_completion_args(shell: str) -> tuple[list[str], str]:
+    cwords = split_words(os.environ['COMP_WORDS'])
+
+    if shell == 'fish':
+        incomplete = os.environ['COMP_CWORD']
+        if incomplete:
+            incomplete = split_words(incomplete)[0]
+        args = cwords[1:]
+        if incomplete and args and args[-1] == incomplete:
+            args.pop()
+        return args, incomplete
+
+    cword = int(os.environ['COMP_CWORD'])
+    args = cwords[1:cword]
+    incomplete = cwords[cword] if cword < len(cwords) else ''
+    return args, incomplete
+
+
+def resolve_target(args: list[str]) -> tuple[str | None, dict[str, str]]:
+    """Find what kind of value is being completed, along with the option values given so far."""
+
+    commands = COMMANDS
+    spec = None
+    option_values = {}
+    positionals = 0
+    pending = None
+
+    for word in args:
+        if pending is not None:
+            option_values[pending] = word
+            pending = None
+        elif word.startswith('-'):
+            if spec is None or word not in spec['options']:
+                return None, option_values
+            if spec['options'][word] != FLAG:
+                pending = word
+        elif spec is None:
+            if (spec := commands.get(word)) is None:
+                return None, option_values
+            if 'commands' in spec:
+                commands = spec['commands']
+                spec = None
+        else:
+            positionals += 1
+
+    if spec is None:
+        return None, option_values
+    if pending is not None:
+        return spec['options'][pending], option_values
+    if positionals < len(spec['args']):
+        return spec['args'][positionals], option_values
+    return None, option_values
+
+
+def _read_marshal(path) -> dict:
+    with open(path, 'rb') as f:
+        return marshal.loads(f.read())
+
+
+def _get_storage_backend(cache: dict) -> str | None:
+    """Get the storage backend in use without importing diary.config, None if the cache cannot tell."""
+
+    if backend := os.environ.get(locations.STORAGE_ENV_VAR):
+        return backend
+    # the default recorded with the cache holds until diary.config is changed
+    if os.stat(locations.CONFIG_PATH).st_mtime_ns == cache.get('config_mtime_ns'):
+        return cache.get('default_storage')
+    return None
+
+
+def load_completion_cache() -> dict | None:
+    try:
+        cache = memoized_load(locations.COMPLETION_CACHE_PATH, _read_marshal)
+        data_mtime = os.stat(locations.DATA_DIR).st_mtime_ns
+        backend = _get_storage_backend(cache)
+    except (OSError, ValueError, EOFError, TypeError, AttributeError):
+        return None
+
+    if cache.get('data_mtime_ns') != data_mtime or backend is None or cache.get('storage') != backend:
+        return None
+    return cache
+
+
+def match_sorted_lines(text: str, prefix: str) -> list[str]:
+    """Find lines starting with prefix in a sorted newline separated string without splitting all of it."""
+
+    text = '\n' + text + '\n'
+    matches = []
+    start = text.find('\n' + prefix)
+    while start != -1 and text.startswith(prefix, start + 1):
+        end = text.index('\n', start + 1)
+        matches.append(text[start + 1:end])
+        start = end if end < len(text) - 1 else -1
+    return matches
+
+
+def get_names(cache: dict) -> list[str]:
+    return cache['names'].split('\n') if cache['names'] else []
+
+
+def get_media(cache: dict, entry_name: str) -> list[str]:
+    media = cache['media']
+    start = media.find(f'\n{entry_name}\t')
+    if start == -1:
+        return []
+    end = media.index('\n', start + 1)
+    return media[start + 1:end].split('\t')[1:]
+
+
+def resolve_entry_name(cache: dict, option_values: dict[str, str]) -> str | None:
+    from datetime import date
+
+    ref = option_values.get('-e') or option_values.get('--entry') or os.environ.get(locations.DATE_ENV_VAR)
+    if not ref:
+        return str(date.today())
+
+    try:
+        return str(date.fromisoformat(ref))
+    except ValueError:
+        pass
+
+    try:
+        number = int(ref, 10)
+    except ValueError:
+        return None
+    names = get_names(cache)
+    if not 0 < number <= len(names):
+        return None
+    return names[-number]
+
+
+def get_completions(args: list[str], incomplete: str) -> list[str] | None:
+    if incomplete.startswith('-'):
+        return None
+
+    target, option_values = resolve_target(args)
+    if target is None or (cache := load_completion_cache()) is None:
+        return None
+
+    if target == ENTRY:
+        return match_sorted_lines(cache['names'], incomplete) if cache['names'] else []
+    if target == TAG:
+        return match_sorted_lines(cache['tags'], incomplete) if cache['tags'] else []
+
+    if (entry_name := resolve_entry_name(cache, option_values)) is None:
+        return None
+    return [f for f in get_media(cache, entry_name) if f.startswith(incomplete)]
+
+
+def fast_complete(instruction: str) -> bool:
+    """
+    Print completions for a `<shell>_complete` instruction.
+
+    Returns False if the request has to be handled by click.
+    """
+
+    shell, _, mode = instruction.partition('_')
+    if mode != 'complete' or shell not in SHELL_FORMATS:
+        return False
+
+    try:
+        args, incomplete = get_completion_args(shell)
+    except (KeyError, ValueError):
+        return False
+
+    completions = None
+    if os.path.exists(locations.SOCKET_PATH):
+        from diary.client import request_completions
+
+        completions = request_completions(args, incomplete)
+    if completions is None:
+        completions = get_completions(args, incomplete)
+    if completions is None:
+        return False
+
+    line_format = SHELL_FORMATS[shell]
+    sys.stdout.write('\n'.join(line_format.format(type='plain', value=c) for c in completions))
+    return True
@@ -1,29 +1,82 @@
 from pathlib import Path
 from os import path
 
-PROGNAME = 'diary'
-
-ROOT_SUBDIR = '.diary'
-DATA_SUBDIR = path.join(ROOT_SUBDIR, 'data')
+from diary.locations import (
+    PROGNAME, LIST_CMDNAME, ROOT_SUBDIR, DATA_SUBDIR, COMPLETION_CACHE_FILE_NAME, SOCKET_FILE_NAME, SERVE_TIMEOUT,
+    CONFIG_PATH,
+    DATE_ENV_VAR, COMPLETE_ENV_VAR, TRACE_ENV_VAR, STORAGE_ENV_VAR,
+)
+
+BLOBS_SUBDIR = path.join(ROOT_SUBDIR, 'blobs')
+PACKS_SUBDIR = path.join(ROOT_SUBDIR, 'packs')
 ENTRY_FILE_NAME = 'entry.txt'
 METADATA_FILE_NAME = 'meta.json'
 MEDIA_SUBDIR_NAME = 'media'
+INDEX_FILE_NAME = 'index.cache'
+SEARCH_INDEX_FILE_NAME = 'search.sqlite3'
+STATS_CACHE_FILE_NAME = 'stats.cache'
+SEARCH_MANIFEST_FILE_NAME = 'search.manifest'
+STATS_MANIFEST_FILE_NAME = 'stats.manifest'
+CHANGE_LOG_FILE_NAME = 'changes.log'
+NAMES_CACHE_FILE_NAME = 'names.json'
+BLOB_REFS_FILE_NAME = 'refs.json'
+JOURNAL_FILE_NAME = 'journal.jsonl'
+MEDIA_VERIFY_FILE_NAME = 'media-verify.json'
+SQLITE_FILE_NAME = 'diary.sqlite3'
+LAYOUT_FILE_NAME = '.layout'
 
 USER_HOME = Path.home()
 DATA_DIR = USER_HOME / Path(DATA_SUBDIR)
+BLOBS_DIR = USER_HOME / Path(BLOBS_SUBDIR)
+PACKS_DIR = USER_HOME / Path(PACKS_SUBDIR)
+BLOB_REFS_PATH = BLOBS_DIR / BLOB_REFS_FILE_NAME
+INDEX_PATH = USER_HOME / Path(ROOT_SUBDIR) / INDEX_FILE_NAME
+SEARCH_INDEX_PATH = USER_HOME / Path(ROOT_SUBDIR) / SEARCH_INDEX_FILE_NAME
+STATS_CACHE_PATH = USER_HOME / Path(ROOT_SUBDIR) / STATS_CACHE_FILE_NAME
+SEARCH_MANIFEST_PATH = USER_HOME / Path(ROOT_SUBDIR) / SEARCH_MANIFEST_FILE_NAME
+STATS_MANIFEST_PATH = USER_HOME / Path(ROOT_SUBDIR) / STATS_MANIFEST_FILE_NAME
+CHANGE_LOG_PATH = USER_HOME / Path(ROOT_SUBDIR) / CHANGE_LOG_FILE_NAME
+NAMES_CACHE_PATH = USER_HOME / Path(ROOT_SUBDIR) / NAMES_CACHE_FILE_NAME
+COMPLETION_CACHE_PATH = USER_HOME / Path(ROOT_SUBDIR) / COMPLETION_CACHE_FILE_NAME
+JOURNAL_PATH = USER_HOME / Path(ROOT_SUBDIR) / JOURNAL_FILE_NAME
+MEDIA_VERIFY_PATH = USER_HOME / Path(ROOT_SUBDIR) / MEDIA_VERIFY_FILE_NAME
+SQLITE_PATH = USER_HOME / Path(ROOT_SUBDIR) / SQLITE_FILE_NAME
+SOCKET_PATH = USER_HOME / Path(ROOT_SUBDIR) / SOCKET_FILE_NAME
+
+# fsync policy for metadata and journal writes:
+# 'always' syncs files and their directories, 'file' syncs files only, 'never' leaves it to the OS.
+# Caches that can be rebuilt are never synced.
+FSYNC_POLICY = 'file'
+
+# storage backend for entry texts and metadata: 'directory' or 'sqlite' (see diary.utils.storage),
+# can be overridden with the DIARY_STORAGE variable
+STORAGE_BACKEND = 'directory'
+
+# placement of entry directories in DATA_DIR: 'flat' or 'sharded' by year and month (see diary.utils.layout),
+# used until `diary migrate-layout` records a layout in the data directory
+DATA_LAYOUT = 'flat'
+
+# seconds after which the search and stats caches walk the whole data directory again,
+# to find entry files changed in place by other programs (see diary.utils.manifest)
+CHANGE_SCAN_INTERVAL = 300
 
 NON_PAGED_ENTRY_COUNT = 100
 SHORT_TEXT_SYMBOL_LIMIT = 30
+NON_PAGED_ENTRY_SIZE = 64 * 1024
+VIEW_CHUNK_SIZE = 64 * 1024
+SEARCH_RESULT_LIMIT = 20
+SEARCH_SNIPPET_WIDTH = 60
+MEDIA_IMPORT_WORKERS = 8
+BATCH_WORKERS = 8
+# None hashes with one process per CPU
+MEDIA_VERIFY_WORKERS = None
 
-DATE_ENV_VAR = 'DIARY_TODAY'
 
 ENTRY_REF_VARNAME = 'entry'
 ENTRY_REF_METAVAR = 'ENTRY'
 FILE_VARNAME = 'file'
 FILE_METAVAR = 'FILE'
 
-LIST_CMDNAME = 'list'
-
 NAME_OPTION_METAVAR = 'NAME'
 TAG_OPTION_METAVAR = 'TAG'
 
@@ -52,7 +105,7 @@ It is also possible to set the {DATE_ENV_VAR} variable to change the default dat
 MEDIA_HELP = """
 Manage entry media.
 
-All commands in this group take a required argument FILE which determines the managed file.
+Most commands in this group take a required argument FILE which determines the managed file.
 It is either a local file path to add to an entry, or a name of a file that belongs to an entry.
 """
 
@@ -67,8 +120,8 @@ and additional metadata can be added via {NAME_OPTION_METAVAR} and {TAG_OPTION_M
 ADD_MEDIA_HELP = f"""
 Add media to an entry.
 
-Provide a local file path in the {FILE_METAVAR} param.
-The file will be added to the entry {ENTRY_REF_METAVAR} or today's entry by default.
-The file can be named via {FILENAME_METAVAR}
-and described via {COMMENT_METAVAR} options - useful for later management.
+Provide one or more local file paths, directories or glob patterns in the {FILE_METAVAR} param.
+The files will be added to the entry {ENTRY_REF_METAVAR} or today's entry by default.
+A single file can be named via {FILENAME_METAVAR},
+and files can be described via {COMMENT_METAVAR} options - useful for later management.
 """
@@ -1,81 +1,189 @@
+import heapq
 import os
-import shutil
+from contextlib import closing
+from datetime import date
+from typing import Iterable
 
 import click
 
 from diary import config
 from diary.utils.entries import (
-    get_entry_path, get_metadata_path, get_metadata, upsert_metadata,
+    get_metadata_path, get_metadata, upsert_metadata,
+    get_index, rebuild_index, entry_exists, create_entry, map_entry_text,
 )
+from diary.utils.index import (
+    update_index_entry, remove_index_entry, get_tag_postings, get_data_dir_mtime, accept_data_dir_change,
+    index_record, load_index,
+    drop_index,
+)
+from diary.utils.names import invalidate_names_cache, get_entry_names_range
+from diary.utils.layout import (
+    get_entry_dir, get_layout, get_layout_dir, iter_entry_dirs, migrate_layout, note_entry_change,
+)
+from diary.utils.packs import pack_entries
+from diary.utils.storage import get_storage, make_storage, DIRECTORY
 from diary.utils.models import Entry, MediaEntry
+from diary.utils.stats import collect_stats
+from diary.utils.query import evaluate_query
+from diary.utils.search import refresh_search_index, search_index, get_snippet
+from diary.utils.text import read_prefix, head_range, tail_range, iter_chunks
+from diary.utils.trace import span
+from diary.media.store import release_refs
 from diary.utils.editing import (
     prompt_metadata_update, UserInputError, EmptyMetadataError, EditAbort
 )
 
 
-def get_entry_names() -> list[str] | None:
-    if not os.path.exists(config.DATA_DIR):
-        click.echo('No entries found.')
+def edit_entry(entry_name: str):
+    is_new = not entry_exists(entry_name)
+    if not create_entry(entry_name):
+        click.echo(f'Could not create entry in {config.DATA_DIR}, check access.')
         return
 
-    return os.listdir(config.DATA_DIR)
+    if is_new:
+        update_index_entry(entry_name=entry_name, metadata=get_metadata(entry_name=entry_name))
 
-
-def edit_entry(entry_name: str):
-    entry_path = get_entry_path(entry_name=entry_name, create=True)
-    if entry_path is None:
-        click.echo(f'Could not create entry in {config.DATA_DIR}, check access.')
-    else:
+    storage = get_storage()
+    if (entry_path := storage.get_text_file(entry_name)) is not None:
         click.edit(filename=str(entry_path))
+        note_entry_change(entry_name)
+    elif (text := click.edit(text=storage.read_text(entry_name) or '', extension='.txt')) is not None:
+        storage.write_text(entry_name, text)
+
+
+def _select_entries(entries: Iterable[str], limit: int = None, offset: int = 0) -> list[str]:
+    """
+    Pick entries for a listing page, most recent first.
+
+    With a limit, only `offset + limit` names are kept in a heap while consuming the stream.
+    """
+
+    if limit is None:
+        return sorted(entries, reverse=True)[offset:]
+    return heapq.nlargest(offset + limit, entries)[offset:]
 
 
 def _iterate_over_entries(
         entries: list[str],
+        records: dict[str, dict],
         result_map: dict[int, str],
-        tags: set[str] = None,
-        no_tip: bool = False
+        no_tip: bool = False,
+        start: int = 1,
 ):
 
-    index = 1
+    index = start
     for entry in entries:
-        entry_metadata = get_metadata(entry_name=entry) or Entry()
+        record = records.get(entry) or {}
 
-        if tags:
-            entry_tags = set(entry_metadata.tags)
-            if not entry_tags.intersection(tags):
-                continue
-
-        displayed_entry = f'{click.style(str(index) + ".", fg="green")} {entry}'
-        if entry_metadata.title:
-            displayed_entry += f' - {entry_metadata.title}'
-        displayed_entry += '\n'
+        with span('render.entry'):
+            displayed_entry = f'{click.style(str(index) + ".", fg="green")} {entry}'
+            if title := record.get('title'):
+                displayed_entry += f' - {title}'
+            displayed_entry += '\n'
 
         result_map[index] = entry
-        if index == 1 and not no_tip:
+        if index == start and not no_tip:
             yield 'Choose entry number:\n'
         yield displayed_entry
 
         index += 1
 
 
-def list_entries(tags: tuple[str], pages: bool, no_return: bool) -> dict[int, str] | None:
+def _filter_entries(index: dict, tags: tuple[str], query: tuple = None) -> set[str]:
+    """Get entries with any of the tags that also match the parsed tag query."""
+
+    entry_names = get_tag_postings(index, set(tags)) if tags else None
+    if query is not None:
+        matched = evaluate_query(query, index)
+        entry_names = set(matched) if entry_names is None else entry_names.intersection(matched)
+    return entry_names
+
+
+def list_entries(
+        tags: tuple[str],
+        pages: bool,
+        no_return: bool,
+        limit: int = None,
+        offset: int = 0,
+        since: str = None,
+        until: str = None,
+        query: tuple = None,
+) -> dict[int, str] | None:
+
+    if not os.path.exists(config.DATA_DIR):
+        click.echo('No entries found.')
+        return None
 
-    entries = get_entry_names()
+    if since or until:
+        in_range = get_entry_names_range(since=since, until=until)
+        if tags or query:
+            index = get_index()
+            records = index['entries']
+            entries = _select_entries(
+                _filter_entries(index, tags, query).intersection(in_range),
+                limit=limit,
+                offset=offset,
+            )
+        else:
+            entries = in_range[::-1][offset:offset + limit if limit else None]
+            if (index := load_index()) is not None:
+                records = index['entries']
+            else:
+                # without an up to date index, only the metadata of the listed entries is read
+                records = {entry: index_record(get_metadata(entry_name=entry)) for entry in entries}
+    else:
+        index = get_index()
+        records = index['entries']
+        entries = _select_entries(
+            _filter_entries(index, tags, query) if tags or query else records,
+            limit=limit,
+            offset=offset,
+        )
     if not entries:
         return None
 
-    entries.sort(reverse=True)
     entry_count = len(entries)
 
-    tags = set(tags)
     result_map = {}
 
-    entries = list(_iterate_over_entries(entries=entries, result_map=result_map, tags=tags, no_tip=no_return))
+    entries = _iterate_over_entries(
+        entries=entries, records=records, result_map=result_map, no_tip=no_return, start=offset + 1
+    )
     if pages or entry_count > config.NON_PAGED_ENTRY_COUNT:
-        click.echo_via_pager(entries)
+        with span('render.pager'):
+            click.echo_via_pager(entries)
     else:
-        for entry in entries:
-            click.echo(entry, nl=False)
+        with span('render.echo'):
+            for entry in entries:
+                click.echo(entry, nl=False)
+
+    return result_map if not no_return else None
+
+
+def search_entries(query: str, no_return: bool) -> dict[int, str] | None:
+
+    if not os.path.exists(config.DATA_DIR):
+        click.echo('No entries found.')
+        return None
+
+    records = get_index()['entries']
+    with closing(refresh_search_index()) as index:
+        found = search_index(index, query=query)
+    if not found:
+        click.echo('No matching entries found.')
+        return None
+
+    if not no_return:
+        click.echo('Choose entry number:')
+
+    result_map = {}
+    for index, entry in enumerate(found, start=1):
+        result_map[index] = entry
+        displayed_entry = f'{click.style(str(index) + ".", fg="green")} {entry}'
+        if title := records.get(entry, {}).get('title'):
+            displayed_entry += f' - {title}'
+        click.echo(displayed_entry)
+        click.echo(f'    {get_snippet(entry_name=entry, query=query)}')
 
     return result_map if not no_return else None
 
@@ -96,7 +204,7 @@ def add_metadata(entry_name: str, title: str = None, tags: tuple[str] = None):
 
 def update_entry_meta(entry_name: str):
 
-    if not get_entry_path(entry_name=entry_name):
+    if not entry_exists(entry_name):
         click.echo('Entry not found, cannot edit metadata.')
         return
 
@@ -116,63 +224,88 @@ def update_entry_meta(entry_name: str):
         click.echo(f'Successfully updated metada for entry {entry_name}.')
 
 
-def echo_media_data(media: list[MediaEntry]):
+def _iter_media_data(media: list[MediaEntry]):
     prefix = 'Name:'
     extra_spacing = 12
     max_line_length = max([len(m.file_name) for m in media]) + len(prefix) + extra_spacing
     for media_file in media:
         fname = media_file.file_name
-        click.echo(
-            f'{click.style(prefix, fg="green")} {fname}'.ljust(max_line_length),
-            nl=False
-        )
+        yield f'{click.style(prefix, fg="green")} {fname}'.ljust(max_line_length)
         if media_file.description:
-            description = f' {click.style("Description:", fg="green")} {media_file.description}'
-            click.echo(description, nl=False)
-        click.echo()
+            yield f' {click.style("Description:", fg="green")} {media_file.description}'
+        yield '\n'
 
 
-def view_entry(entry_name: str, short: bool):
-    entry_path = get_entry_path(entry_name=entry_name)
-
-    if entry_path is None:
-        click.echo(f'Could not find entry {entry_name}.')
-        return
-
-    metadata = get_metadata(entry_name=entry_name)
-    with open(str(entry_path), 'r') as f:
-        entry_text = f.read()
-
-    if metadata is None and not entry_text:
-        click.echo(f'{entry_name} is empty.')
-        return
-
-    metadata = metadata if metadata is not None else Entry()
-    add_spacing = not short
+def _iter_entry_view(
+        metadata: Entry,
+        text_range: tuple,
+        short: bool,
+        lines: int = None,
+        tail: int = None,
+):
+    buffer, start, end = text_range
+    add_spacing = '\n' if not short else ''
 
     if metadata.title:
-        click.echo(nl=add_spacing)
-        click.echo(f'{click.style("Title:", fg="green")} {metadata.title}')
+        yield add_spacing
+        yield f'{click.style("Title:", fg="green")} {metadata.title}\n'
     if metadata.tags:
-        click.echo(nl=add_spacing)
-        click.echo(f'{click.style("Tags:", fg="green")} {", ".join(metadata.tags)}')
+        yield add_spacing
+        yield f'{click.style("Tags:", fg="green")} {", ".join(metadata.tags)}\n'
     if metadata.media:
-        click.echo(nl=add_spacing)
-        click.echo(click.style("Media:", fg="green"))
-        echo_media_data(metadata.media)
-    if entry_text:
-        click.echo(nl=add_spacing)
-        click.echo(click.style("Entry: ", fg="green"), nl=add_spacing)
+        yield add_spacing
+        yield click.style("Media:", fg="green") + '\n'
+        yield from _iter_media_data(metadata.media)
+    if end > start:
+        yield add_spacing
+        yield click.style("Entry: ", fg="green") + add_spacing
         if short:
-            entry_text = entry_text[:config.SHORT_TEXT_SYMBOL_LIMIT].strip() + '...'
-        click.echo(entry_text)
-    click.echo(nl=add_spacing)
+            yield read_prefix(buffer, start, end, chars=config.SHORT_TEXT_SYMBOL_LIMIT).strip() + '...\n'
+        else:
+            if lines:
+                start, end = head_range(buffer, start, end, lines=lines)
+            elif tail:
+                start, end = tail_range(buffer, start, end, lines=tail)
+            with span('entry.read') as s:
+                s['bytes'] = end - start
+                yield from iter_chunks(buffer, start, end, chunk_size=config.VIEW_CHUNK_SIZE)
+            yield '\n'
+    yield add_spacing
+
+
+def view_entry(entry_name: str, short: bool, lines: int = None, tail: int = None):
+    """
+    Show the entry metadata and text.
+
+    Only the part of the text that is shown is read, and texts above
+    `config.NON_PAGED_ENTRY_SIZE` are streamed through the pager.
+    """
+
+    with map_entry_text(entry_name=entry_name) as text_range:
+        if text_range is None:
+            click.echo(f'Could not find entry {entry_name}.')
+            return
+
+        metadata = get_metadata(entry_name=entry_name)
+        _, start, end = text_range
+
+        if metadata is None and end == start:
+            click.echo(f'{entry_name} is empty.')
+            return
+
+        metadata = metadata if metadata is not None else Entry()
+        view = _iter_entry_view(metadata, text_range, short=short, lines=lines, tail=tail)
+        if not short and not lines and not tail and end - start > config.NON_PAGED_ENTRY_SIZE:
+            with span('render.pager'):
+                click.echo_via_pager(view)
+        else:
+            for part in view:
+                click.echo(part, nl=False)
 
 
 def delete_entry(entry_name: str, do_not_prompt: bool):
-    entry_path = get_entry_path(entry_name=entry_name)
 
-    if entry_path is None:
+    if not entry_exists(entry_name):
         click.echo(f'Could not find entry {entry_name}.')
         return
 
@@ -182,30 +315,136 @@ def delete_entry(entry_name: str, do_not_prompt: bool):
             click.echo('Aborting.')
             return
 
+    metadata = get_metadata(entry_name=entry_name) or Entry()
     try:
-        shutil.rmtree(entry_path.parent)
+        get_storage().delete(entry_name)
     except Exception:
         click.echo(f'Could not delete entry from {config.DATA_DIR}.')
         return
 
+    release_refs([m.digest for m in metadata.media])
+
+    invalidate_names_cache()
+    remove_index_entry(entry_name=entry_name)
     click.echo(f'Successfully deleted entry {entry_name}.')
 
 
-def list_entry_tags():
+def list_entry_tags(counts: bool = False):
 
-    entries = get_entry_names()
+    postings = get_index()['tags']
 
-    tags = set()
-    for entry in entries:
-        if not (metadata := get_metadata(entry_name=entry)):
-            continue
-        entry_tags = set(metadata.tags)
-        tags.update(entry_tags)
-
-    if tags:
-        tags = list(tags)
-        tags.sort()
-        for tag in tags:
-            click.echo(tag)
+    if postings:
+        for tag in sorted(postings):
+            if counts:
+                click.echo(f'{tag} {click.style(str(len(postings[tag])), fg="green")}')
+            else:
+                click.echo(tag)
     else:
         click.echo('No tags found.')
+
+
+def show_stats():
+    if not os.path.exists(config.DATA_DIR):
+        click.echo('No entries found.')
+        return
+
+    stats = collect_stats()
+    if not stats.entries:
+        click.echo('No entries found.')
+        return
+
+    def field(name: str, value):
+        click.echo(f'{click.style(name + ":", fg="green")} {value}')
+
+    field('Entries', stats.entries)
+    field('Words', f'{stats.words} ({stats.words // stats.entries} per entry)')
+    field('Longest streak', f'{stats.longest_streak} days')
+    field('Current streak', f'{stats.current_streak} days')
+    field('Media', f'{stats.media_files} files, {stats.media_bytes / 1024 ** 2:.1f} MB')
+
+    click.echo(click.style('Entries per month:', fg='green'))
+    for month, count in stats.months.items():
+        click.echo(f'  {month} {count}')
+    if stats.tags:
+        click.echo(click.style('Tags:', fg='green'))
+        for tag, count in sorted(stats.tags.items(), key=lambda i: (-i[1], i[0])):
+            click.echo(f'  {tag} {count}')
+
+
+def pack_year(year: int):
+    if get_storage().name != DIRECTORY:
+        click.echo('Packing is only supported by the directory storage.')
+        return
+
+    if year >= date.today().year:
+        click.echo(f'Year {year} is not closed yet, only past years can be packed.')
+        return
+
+    names = get_entry_names_range(since=f'{year:04}-01-01', until=f'{year:04}-12-31')
+    unpacked = [n for n in names if get_entry_dir(n).is_dir()]
+    if not unpacked:
+        click.echo(f'No unpacked entries found for {year}.')
+        return
+
+    data_mtime = get_data_dir_mtime()
+    packed = pack_entries(f'{year:04}', entry_names=unpacked)
+    invalidate_names_cache()
+    accept_data_dir_change(data_mtime)
+
+    click.echo(f'Packed {len(packed)} entries of {year}.')
+    if skipped := len(unpacked) - len(packed):
+        click.echo(f'Left {skipped} entries with media files unpacked.')
+
+
+def migrate_entries(backend: str):
+    source = get_storage()
+    if backend == source.name:
+        click.echo(f'Entries are already kept in the {backend} storage.')
+        return
+
+    target = make_storage(backend)
+    migrated = skipped = 0
+    with target.transaction():
+        for entry_name in source.iter_names():
+            if target.read_text(entry_name) is not None or target.read_metadata(entry_name) is not None:
+                skipped += 1
+                continue
+
+            text = source.read_text(entry_name)
+            metadata = source.read_metadata(entry_name)
+            if text is not None:
+                target.write_text(entry_name, text, mtime_ns=source.stat_text(entry_name)[0])
+            if metadata is not None:
+                target.write_metadata(entry_name, metadata)
+            if text is None and metadata is None:
+                target.create(entry_name)
+            migrated += 1
+
+    invalidate_names_cache()
+    drop_index()
+    click.echo(f'Copied {migrated} entries to the {backend} storage.')
+    if skipped:
+        click.echo(f'Skipped {skipped} entries already present there.')
+    click.echo(
+        f'Set {config.STORAGE_ENV_VAR}={backend} or STORAGE_BACKEND in diary.config to use it, '
+        f'the {source.name} storage was left in place.'
+    )
+
+
+def migrate_entry_layout(layout: str):
+    if layout == get_layout() and not any(
+        entry_dir != get_layout_dir(entry_name, layout) for entry_name, entry_dir in iter_entry_dirs()
+    ):
+        click.echo(f'Entries are already in the {layout} layout.')
+        return
+
+    data_mtime = get_data_dir_mtime()
+    moved = migrate_layout(layout)
+    invalidate_names_cache()
+    accept_data_dir_change(data_mtime)
+    click.echo(f'Moved {moved} entries to the {layout} layout.')
+
+
+def reindex_entries():
+    index = rebuild_index()
+    click.echo(f'Indexed {len(index["entries"])} entries.')
@@ -0,0 +1,31 @@
+"""
+Names and locations needed before the CLI is loaded.
+
+The shell completion and daemon fast paths (`diary.complete`, `diary.client`) run on every
+keystroke or command, so this module only imports `os` and builds paths as strings.
+`diary.config` takes these values and exposes the paths as `pathlib.Path` objects.
+"""
+import os
+
+PROGNAME = 'diary'
+LIST_CMDNAME = 'list'
+
+ROOT_SUBDIR = '.diary'
+DATA_SUBDIR = os.path.join(ROOT_SUBDIR, 'data')
+COMPLETION_CACHE_FILE_NAME = 'complete.cache'
+SOCKET_FILE_NAME = 'diary.sock'
+
+USER_HOME = os.path.expanduser('~')
+DATA_DIR = os.path.join(USER_HOME, DATA_SUBDIR)
+COMPLETION_CACHE_PATH = os.path.join(USER_HOME, ROOT_SUBDIR, COMPLETION_CACHE_FILE_NAME)
+SOCKET_PATH = os.path.join(USER_HOME, ROOT_SUBDIR, SOCKET_FILE_NAME)
+# settings in diary.config are checked against its mtime instead of importing it
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.py')
+
+# seconds to wait for `diary serve` before running a command directly
+SERVE_TIMEOUT = 10
+
+DATE_ENV_VAR = 'DIARY_TODAY'
+COMPLETE_ENV_VAR = '_DIARY_COMPLETE'
+TRACE_ENV_VAR = 'DIARY_TRACE'
+STORAGE_ENV_VAR = 'DIARY_STORAGE'
@@ -4,11 +4,10 @@ import click
 
 from diary import config
 from diary.utils.cli import today, get_name, complete_date, complete_filename
-from diary.media.entries import (
-    add_entry_media, view_entry_media, update_media_meta, delete_media
-)
 from diary.types import ENTRY_REF
 
+# Command implementations are imported inside the commands, as in diary.cli.
+
 
 entry_option = click.option(
     '-e', '--entry',
@@ -30,8 +29,10 @@ file_argument = click.argument(
 @click.command(name='add', help=config.ADD_MEDIA_HELP)
 @click.argument(
     config.FILE_VARNAME,
-    type=click.Path(exists=True, dir_okay=False),
-    metavar=config.FILE_METAVAR,
+    type=click.Path(),
+    nargs=-1,
+    required=True,
+    metavar=f'{config.FILE_METAVAR}...',
 )
 @entry_option
 @click.option(
@@ -46,10 +47,18 @@ file_argument = click.argument(
     metavar=config.COMMENT_METAVAR,
     help='Short description of file contents.',
 )
-def add_media(file: str, entry: date | int, name: str, comment: str):
+def add_media(file: tuple[str], entry: date | int, name: str, comment: str):
+    from diary.media.entries import add_entry_media, expand_media_paths
+
+    file_paths, unmatched = expand_media_paths(file)
+    if unmatched:
+        raise click.BadParameter(f'no files found for {", ".join(unmatched)}', param_hint=config.FILE_METAVAR)
+    if name and len(file_paths) > 1:
+        raise click.BadParameter('can only be used with a single file', param_hint='--name')
+
     entry_name = get_name(entry)
     description = comment.strip() if comment else comment
-    add_entry_media(entry_name=entry_name, file_path=file, file_name=name, description=description)
+    add_entry_media(entry_name=entry_name, file_paths=file_paths, file_name=name, description=description)
 
 
 @click.command(name='view')
@@ -57,16 +66,34 @@ def add_media(file: str, entry: date | int, name: str, comment: str):
 @entry_option
 def view_media(file: str, entry: date | int):
     """View an entry's media file."""
+    from diary.media.entries import view_entry_media
 
     entry_name = get_name(entry)
     view_entry_media(entry_name=entry_name, file=file)
 
 
+@click.command(name='edit')
+@file_argument
+@entry_option
+def edit_media(file: str, entry: date | int):
+    """
+    Edit an entry's media file.
+
+    Files are stored once and shared between entries, so the entry gets its own copy
+    of the file to edit. The file is stored again once the program opening it exits.
+    """
+    from diary.media.entries import edit_entry_media
+
+    entry_name = get_name(entry)
+    edit_entry_media(entry_name=entry_name, file=file)
+
+
 @click.command(name='edit-meta')
 @file_argument
 @entry_option
 def edit_meta(file: str, entry: date | int):
     """Edit an entry's file metadata."""
+    from diary.media.entries import update_media_meta
 
     entry_name = get_name(entry)
     update_media_meta(entry_name=entry_name, file_name=file)
@@ -78,11 +105,33 @@ def edit_meta(file: str, entry: date | int):
 @click.confirmation_option(prompt='Delete the file with all its metadata?')
 def delete(file: str, entry: date | int):
     """Delete an entry's file."""
+    from diary.media.entries import delete_media
 
     entry_name = get_name(entry)
     delete_media(entry_name=entry_name, file=file)
 
 
+@click.command(name='gc')
+def gc():
+    """Remove stored files no entry refers to."""
+    from diary.media.entries import collect_media_garbage
+
+    collect_media_garbage()
+
+
+@click.command(name='verify')
+def verify():
+    """
+    Check media files against their recorded hashes.
+
+    Reports files missing from media directories, files absent from metadata and altered files.
+    Hashes of files added without one are recorded on the first run.
+    """
+    from diary.media.entries import verify_entry_media
+
+    verify_entry_media()
+
+
 @click.group(help=config.MEDIA_HELP)
 def media():
     pass
@@ -90,5 +139,8 @@ def media():
 
 media.add_command(add_media)
 media.add_command(view_media)
+media.add_command(edit_media)
 media.add_command(edit_meta)
 media.add_command(delete)
+media.add_command(gc)
+media.add_command(verify)
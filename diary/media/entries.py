@@ -1,50 +1,115 @@
+import glob
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-import shutil
 
 import click
 
 from diary import config
 from diary.utils.entries import (
     get_metadata_path, get_entry_media_path, upsert_metadata,
-    get_metadata, get_entry_path, remove_file_metadata
+    get_metadata, entry_exists, remove_file_metadata
 )
 from diary.utils.editing import (
     prompt_metadata_update, UserInputError, EmptyMetadataError, EditAbort
 )
 from diary.utils.models import Entry, MediaEntry
+from diary.media.store import store_blob, link_blob, unshare_blob, add_refs, release_refs, collect_garbage
+from diary.media.verify import verify_media
+from diary.utils.layout import note_entry_change
 
 
-def add_entry_media(entry_name: str, file_path: str, file_name: str = None, description: str = None):
+def expand_media_paths(paths: tuple[str]) -> tuple[list[str], list[str]]:
+    """Expand directories and glob patterns into file paths, return the files and the unmatched paths."""
+
+    files = []
+    unmatched = []
+    for path in paths:
+        if os.path.isdir(path):
+            matched = [str(p) for p in sorted(Path(path).iterdir()) if p.is_file() and not p.name.startswith('.')]
+        elif os.path.isfile(path):
+            matched = [path]
+        else:
+            matched = [p for p in sorted(glob.glob(path, recursive=True)) if os.path.isfile(p)]
+
+        if matched:
+            files.extend(matched)
+        else:
+            unmatched.append(path)
+    return files, unmatched
+
+
+def _import_media_file(file_path: str, dest_path: str) -> str:
+    digest = store_blob(file_path)
+    link_blob(digest, dest_path)
+    return digest
+
+
+def add_entry_media(entry_name: str, file_paths: list[str], file_name: str = None, description: str = None):
     media_path = get_entry_media_path(entry_name=entry_name, create=True)
     if media_path is None:
         click.echo(f'could not add files to {config.DATA_DIR}, check access')
         return
 
     media_dir_path = str(media_path)
-    src_path = Path(file_path)
-    dest_name = ''.join([file_name, *src_path.suffixes]) if file_name else src_path.name
-    dest_path = os.path.join(media_dir_path, dest_name)
-
-    try:
-        shutil.copy(file_path, dest_path)
-    except Exception:
-        click.echo(f'could not copy file to {media_dir_path}, check access')
+    dest_names = {}
+    failed = {}
+    for file_path in file_paths:
+        src_path = Path(file_path)
+        dest_name = ''.join([file_name, *src_path.suffixes]) if file_name else src_path.name
+        if dest_name in dest_names.values():
+            failed[file_path] = f'duplicate file name {dest_name}'
+        else:
+            dest_names[file_path] = dest_name
+
+    digests = {}
+    with ThreadPoolExecutor(max_workers=config.MEDIA_IMPORT_WORKERS) as executor:
+        futures = {
+            executor.submit(_import_media_file, file_path, os.path.join(media_dir_path, dest_name)): file_path
+            for file_path, dest_name in dest_names.items()
+        }
+        with click.progressbar(
+            as_completed(futures), length=len(futures), label='Copying files', hidden=len(futures) < 2
+        ) as progress:
+            for future in progress:
+                file_path = futures[future]
+                try:
+                    digests[file_path] = future.result()
+                except Exception:
+                    failed[file_path] = f'could not copy file to {media_dir_path}, check access'
+
+    added = [(dest_names[p], digests[p]) for p in file_paths if p in digests]
+    if not added:
+        for file_path, reason in failed.items():
+            click.echo(f'{file_path}: {reason}')
         return
 
     metadata_path = get_metadata_path(entry_name=entry_name, create=True)
     if metadata_path is None:
         click.echo(f'could not edit metadata in {config.DATA_DIR}, check access')
-        os.remove(dest_path)
+        for dest_name, _ in added:
+            os.remove(os.path.join(media_dir_path, dest_name))
         return
 
-    metadata = Entry(media=[MediaEntry(file_name=dest_name, description=description)])
+    added_names = {dest_name for dest_name, _ in added}
+    replaced = [m.digest for m in (get_metadata(entry_name=entry_name) or Entry()).media if m.file_name in added_names]
+    metadata = Entry(media=[
+        MediaEntry(file_name=dest_name, description=description, digest=digest) for dest_name, digest in added
+    ])
     upsert_metadata(
         metadata_path=str(metadata_path),
         entry_data=metadata
     )
-
-    click.echo(f'Added {dest_name} to entry {entry_name}')
+    add_refs([digest for _, digest in added])
+    release_refs(replaced)
+    note_entry_change(entry_name)
+
+    for file_path, reason in failed.items():
+        click.echo(f'{file_path}: {reason}')
+    if len(added) == 1 and not failed:
+        click.echo(f'Added {added[0][0]} to entry {entry_name}')
+    else:
+        click.echo(f'Added {len(added)} files to entry {entry_name}, {len(failed)} failed')
 
 
 def view_entry_media(entry_name: str, file: str):
@@ -70,9 +135,42 @@ def view_entry_media(entry_name: str, file: str):
     click.launch(str(media_dir_path / file))
 
 
+def edit_entry_media(entry_name: str, file: str):
+    metadata = get_metadata(entry_name=entry_name)
+    media_dir_path = get_entry_media_path(entry_name=entry_name)
+    file_meta = next((m for m in metadata.media if m.file_name == file), None) if metadata else None
+
+    if file_meta is None or media_dir_path is None or not (media_dir_path / file).is_file():
+        click.echo(f'file {file} not found for entry {entry_name}')
+        return
+
+    media_path = str(media_dir_path / file)
+    try:
+        unshare_blob(media_path)
+    except OSError:
+        click.echo(f'could not edit files in {media_dir_path}, check access')
+        return
+    click.launch(media_path, wait=True)
+
+    # the edited file goes back to the blob store, as if it was added again
+    digest = _import_media_file(media_path, media_path)
+    if digest == file_meta.digest:
+        click.echo(f'file {file} of entry {entry_name} is unchanged')
+        return
+
+    upsert_metadata(
+        metadata_path=str(get_metadata_path(entry_name=entry_name)),
+        entry_data=Entry(media=[MediaEntry(file_name=file, description=file_meta.description, digest=digest)]),
+    )
+    add_refs([digest])
+    release_refs([file_meta.digest])
+    note_entry_change(entry_name)
+    click.echo(f'successfully updated file {file} for entry {entry_name}')
+
+
 def update_media_meta(entry_name: str, file_name: str):
 
-    if not get_entry_path(entry_name=entry_name):
+    if not entry_exists(entry_name):
         click.echo('entry not found, cannot edit metadata')
         return
 
@@ -106,7 +204,30 @@ def delete_media(entry_name: str, file: str):
         click.echo(f'file {file} not found for entry {entry_name}')
         return
 
+    metadata = get_metadata(entry_name=entry_name) or Entry()
     media_path.unlink()
     remove_file_metadata(metadata_path=str(metadata_path), file_name=file)
+    release_refs([m.digest for m in metadata.media if m.file_name == file])
+    note_entry_change(entry_name)
 
     click.echo(f'successfully deleted file {file} for entry {entry_name}')
+
+
+def collect_media_garbage():
+    removed, freed = collect_garbage()
+    click.echo(f'removed {removed} unused files, freed {freed} bytes')
+
+
+def verify_entry_media():
+    result = verify_media()
+    for problem, file_path in result.problems:
+        click.echo(f'{problem}: {file_path}')
+
+    mb = result.hashed_bytes / 1024 ** 2
+    rate = mb / result.hash_seconds if result.hash_seconds else 0.0
+    click.echo(
+        f'checked {result.checked} files: hashed {result.hashed} ({mb:.1f} MB at {rate:.1f} MB/s), '
+        f'{result.checked - result.hashed} unchanged, {result.recorded} new hashes recorded'
+    )
+    if not result.problems:
+        click.echo('no problems found')
@@ -0,0 +1,206 @@
+"""
+Content-addressed media store.
+
+Media files are stored once under `config.BLOBS_DIR`, named by their sha256 digest,
+and linked into entry media directories. Reference counts of the digests used
+by entry metadata are kept in `config.BLOB_REFS_PATH`.
+
+Blobs are read-only, and so are entry files hardlinked to them: an entry file is
+replaced by a private copy with `unshare_blob` before it is edited.
+"""
+import errno
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from diary import config
+from diary.utils.files import atomic_write
+
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 1024 * 1024
+BLOB_MODE = 0o444
+
+
+def _get_tmp_path(path: Path) -> Path:
+    return path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+
+
+def hash_file(file_path: str) -> str:
+    with open(file_path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+def get_blob_path(digest: str) -> Path:
+    return config.BLOBS_DIR / digest[:2] / digest[2:]
+
+
+def store_blob(file_path: str) -> str:
+    """Store a file in the blob store unless its contents are already there, return the digest."""
+
+    digest = hash_file(file_path)
+    blob_path = get_blob_path(digest)
+    if blob_path.exists():
+        return digest
+
+    blob_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = _get_tmp_path(blob_path)
+    try:
+        shutil.copyfile(file_path, tmp_path)
+        os.chmod(tmp_path, BLOB_MODE)
+        os.replace(tmp_path, blob_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return digest
+
+
+def store_blob_stream(stream) -> str:
+    """Store the contents of a binary stream in the blob store, hashing while copying, return the digest."""
+
+    config.BLOBS_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = _get_tmp_path(config.BLOBS_DIR / 'stream')
+    try:
+        sha = hashlib.sha256()
+        with open(tmp_path, 'wb') as f:
+            while chunk := stream.read(COPY_CHUNK_SIZE):
+                sha.update(chunk)
+                f.write(chunk)
+
+        digest = sha.hexdigest()
+        blob_path = get_blob_path(digest)
+        if not blob_path.exists():
+            blob_path.parent.mkdir(parents=True, exist_ok=True)
+            os.chmod(tmp_path, BLOB_MODE)
+            os.replace(tmp_path, blob_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return digest
+
+
+def _reflink(src_path: Path, dest_path: str):
+    import fcntl
+
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dest:
+        try:
+            fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+        except OSError:
+            os.remove(dest_path)
+            raise
+
+
+def _place_blob(src_path: Path, dest_path: str):
+    try:
+        _reflink(src_path, dest_path)
+        return
+    except (OSError, ImportError):
+        pass
+
+    # blobs stored before they were made read-only are sealed on first use,
+    # so no entry can change a blob shared with other entries in place
+    try:
+        os.chmod(src_path, BLOB_MODE)
+        os.link(src_path, dest_path)
+        return
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+
+    shutil.copyfile(src_path, dest_path)
+
+
+def link_blob(digest: str, dest_path: str):
+    """
+    Put a blob at dest_path, atomically replacing an existing file.
+
+    Tries a copy-on-write reflink first, then a hardlink, then falls back to a plain copy.
+    """
+
+    tmp_path = _get_tmp_path(Path(dest_path))
+    try:
+        _place_blob(get_blob_path(digest), str(tmp_path))
+        os.replace(tmp_path, dest_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def unshare_blob(dest_path: str):
+    """Replace an entry file linked to a blob with a private writable copy, so it can be edited."""
+
+    stat = os.stat(dest_path)
+    if stat.st_nlink < 2 and stat.st_mode & 0o200:
+        return
+
+    # copyfile does not copy the mode, the copy gets the default one
+    tmp_path = _get_tmp_path(Path(dest_path))
+    try:
+        shutil.copyfile(dest_path, tmp_path)
+        os.replace(tmp_path, dest_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def load_refs() -> dict[str, int]:
+    try:
+        with open(config.BLOB_REFS_PATH, 'r') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return {}
+    return json.loads(content) if content else {}
+
+
+def save_refs(refs: dict[str, int]):
+    config.BLOBS_DIR.mkdir(parents=True, exist_ok=True)
+    atomic_write(config.BLOB_REFS_PATH, json.dumps(refs, separators=(',', ':')))
+
+
+def add_refs(digests: list[str]):
+    if not digests:
+        return
+
+    refs = load_refs()
+    for digest in digests:
+        refs[digest] = refs.get(digest, 0) + 1
+    save_refs(refs)
+
+
+def release_refs(digests: list[str]):
+    digests = [d for d in digests if d]
+    if not digests:
+        return
+
+    refs = load_refs()
+    for digest in digests:
+        count = refs.get(digest, 0) - 1
+        if count > 0:
+            refs[digest] = count
+        else:
+            refs.pop(digest, None)
+    save_refs(refs)
+
+
+def iter_blobs():
+    if not config.BLOBS_DIR.exists():
+        return
+
+    for prefix_dir in config.BLOBS_DIR.iterdir():
+        if not prefix_dir.is_dir():
+            continue
+        for blob_path in prefix_dir.iterdir():
+            if not blob_path.name.startswith('.'):
+                yield prefix_dir.name + blob_path.name, blob_path
+
+
+def collect_garbage() -> tuple[int, int]:
+    """Remove blobs with no references, return the number of removed blobs and freed bytes."""
+
+    refs = load_refs()
+    removed = freed = 0
+    for digest, blob_path in list(iter_blobs()):
+        if refs.get(digest):
+            continue
+        freed += blob_path.stat().st_size
+        blob_path.unlink()
+        removed += 1
+    return removed, freed
@@ -0,0 +1,137 @@
+"""
+Integrity check of entry media files.
+
+The content hash of every media file is compared with the digest recorded in the entry
+metadata, or, for files added without a digest, with the hash recorded by the first check.
+Hashes are kept in `config.MEDIA_VERIFY_PATH` together with the file size and mtime,
+and files whose size and mtime did not change since the last check are not hashed again.
+"""
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from diary import config
+from diary.utils.entries import get_index, get_metadata
+from diary.utils.files import atomic_write, FSYNC_NEVER
+from diary.utils.layout import get_entry_dir
+from diary.utils.manifest import Manifest, MEDIA_PREFIX, scan_manifest
+from diary.media.store import hash_file
+
+VERIFY_STATE_VERSION = 1
+MISSING = 'missing'
+ORPHANED = 'orphaned'
+ALTERED = 'altered'
+UNREADABLE = 'unreadable'
+
+
+@dataclass(slots=True)
+class VerifyResult:
+    problems: list[tuple[str, str]] = field(default_factory=list)
+    checked: int = 0
+    hashed: int = 0
+    hashed_bytes: int = 0
+    recorded: int = 0
+    hash_seconds: float = 0.0
+
+
+def load_verify_state() -> dict:
+    try:
+        with open(config.MEDIA_VERIFY_PATH, 'r') as f:
+            state = json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return {'version': VERIFY_STATE_VERSION, 'files': {}}
+
+    if state.get('version') != VERIFY_STATE_VERSION:
+        return {'version': VERIFY_STATE_VERSION, 'files': {}}
+    return state
+
+
+def save_verify_state(state: dict):
+    config.MEDIA_VERIFY_PATH.parent.mkdir(parents=True, exist_ok=True)
+    atomic_write(config.MEDIA_VERIFY_PATH, json.dumps(state, separators=(',', ':')), fsync=FSYNC_NEVER)
+
+
+def _list_media_files(manifest: Manifest) -> dict[str, dict[str, list[int]]]:
+    """Get the media files with their mtime and size of entries that have media in metadata or on disk."""
+
+    media = {name: {} for name, record in get_index()['entries'].items() if record['media']}
+    for entry_name, files in manifest.items():
+        for file_key, stat in files.items():
+            if file_key.startswith(MEDIA_PREFIX):
+                media.setdefault(entry_name, {})[file_key[len(MEDIA_PREFIX):]] = stat
+    return media
+
+
+def _try_hash_file(file_path: str) -> str:
+    """Hash a file, or return MISSING or UNREADABLE instead of the digest when it cannot be read."""
+
+    try:
+        return hash_file(file_path)
+    except FileNotFoundError:
+        return MISSING
+    except OSError:
+        return UNREADABLE
+
+
+def _hash_files(paths: list[str], workers: int = None) -> list[str]:
+    if len(paths) < 2:
+        return [_try_hash_file(p) for p in paths]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_try_hash_file, paths, chunksize=8))
+
+
+def verify_media(workers: int = config.MEDIA_VERIFY_WORKERS) -> VerifyResult:
+    result = VerifyResult()
+    old_files = load_verify_state()['files']
+    files = {}
+
+    expected = {}
+    to_hash = {}
+    media = _list_media_files(scan_manifest())
+    for entry_name in sorted(media):
+        metadata = get_metadata(entry_name=entry_name)
+        recorded = {m.file_name: m.digest for m in metadata.media} if metadata else {}
+        present = media[entry_name]
+
+        for file_name in sorted(recorded.keys() - present.keys()):
+            result.problems.append((MISSING, f'{entry_name}/{file_name}'))
+        for file_name in sorted(present.keys() - recorded.keys()):
+            result.problems.append((ORPHANED, f'{entry_name}/{file_name}'))
+
+        for file_name in sorted(recorded.keys() & present.keys()):
+            key = f'{entry_name}/{file_name}'
+            mtime_ns, size = present[file_name]
+            old = old_files.get(key)
+            expected[key] = recorded[file_name] or (old or {}).get('expected')
+            result.checked += 1
+
+            if old and old['size'] == size and old['mtime_ns'] == mtime_ns:
+                files[key] = {**old, 'expected': expected[key] or old['hash']}
+            else:
+                files[key] = {'size': size, 'mtime_ns': mtime_ns, 'hash': None}
+                to_hash[key] = str(get_entry_dir(entry_name) / config.MEDIA_SUBDIR_NAME / file_name)
+
+    hash_start = time.perf_counter()
+    digests = _hash_files(list(to_hash.values()), workers=workers)
+    result.hash_seconds = time.perf_counter() - hash_start
+
+    for key, digest in zip(to_hash, digests):
+        # removed or unreadable since the scan, checked again next time
+        if digest in (MISSING, UNREADABLE):
+            result.problems.append((digest, key))
+            del files[key]
+            continue
+        files[key]['hash'] = digest
+        result.hashed += 1
+        result.hashed_bytes += files[key]['size']
+        if expected[key] is None:
+            result.recorded += 1
+        files[key]['expected'] = expected[key] or digest
+
+    for key, record in sorted(files.items()):
+        if record['hash'] != record['expected']:
+            result.problems.append((ALTERED, key))
+
+    save_verify_state({'version': VERIFY_STATE_VERSION, 'files': files})
+    return result
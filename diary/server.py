@@ -0,0 +1,180 @@
+"""
+Resident daemon answering `diary.client` requests over a Unix socket.
+
+The daemon keeps the index, the entry names and the completion cache loaded between
+requests (see `diary.utils.memo`) and runs forwarded commands in-process with their
+output captured. Before each request the data and pack directories are checked for
+changes made by other processes, and in-process caches are dropped when they changed.
+Requests are answered one at a time. Anything that fails is answered with a fallback,
+so the client runs the command itself and reports the error as usual.
+"""
+import io
+import json
+import os
+import signal
+import socketserver
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
+
+import click
+
+from diary import config
+from diary.client import disable_forwarding, is_forwardable, request
+from diary.utils import memo
+from diary.utils.entries import get_index
+from diary.utils.layout import reset_layout
+from diary.utils.names import get_sorted_entry_names
+from diary.utils.packs import clear_pack_cache
+
+FALLBACK = {'fallback': True}
+
+_snapshot = None
+
+
+def _stat_mtime(path) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _refresh():
+    """Drop in-process caches if entries were added, removed, packed or moved since the last request."""
+
+    global _snapshot
+
+    snapshot = (_stat_mtime(config.DATA_DIR), _stat_mtime(config.PACKS_DIR))
+    if snapshot != _snapshot:
+        clear_pack_cache()
+        reset_layout()
+        _snapshot = snapshot
+
+
+@contextmanager
+def _request_env(env: dict[str, str | None]):
+    saved = {name: os.environ.get(name) for name in env}
+
+    def apply(values):
+        for name, value in values.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    apply(env)
+    try:
+        yield
+    finally:
+        apply(saved)
+
+
+def _run_command(argv: list[str], env: dict[str, str | None], color: bool) -> dict:
+    from diary.cli import cli
+
+    if not is_forwardable(argv):
+        return FALLBACK
+    if env.get(config.STORAGE_ENV_VAR) != os.environ.get(config.STORAGE_ENV_VAR):
+        return FALLBACK
+
+    paged = False
+    echo_via_pager = click.echo_via_pager
+
+    def capture_pager(text_or_generator, color=None):
+        nonlocal paged
+        paged = True
+        parts = text_or_generator() if callable(text_or_generator) else text_or_generator
+        for part in [parts] if isinstance(parts, str) else parts:
+            click.echo(part, nl=False, color=color)
+
+    output, errors = io.StringIO(), io.StringIO()
+    click.echo_via_pager = capture_pager
+    try:
+        with _request_env(env), redirect_stdout(output), redirect_stderr(errors):
+            status = cli.main(argv, prog_name=config.PROGNAME, standalone_mode=False, color=color)
+    except (click.ClickException, click.Abort):
+        return FALLBACK
+    finally:
+        click.echo_via_pager = echo_via_pager
+
+    return {
+        'status': status if isinstance(status, int) else 0,
+        'output': output.getvalue(),
+        'errors': errors.getvalue(),
+        'paged': paged,
+    }
+
+
+def _resolve_entry_number(number: int) -> dict:
+    names = get_sorted_entry_names()
+    if not 0 < number <= len(names):
+        return FALLBACK
+    return {'name': names[-number]}
+
+
+def _complete(args: list[str], incomplete: str) -> dict:
+    from diary.complete import get_completions
+
+    if (completions := get_completions(args, incomplete)) is None:
+        return FALLBACK
+    return {'completions': completions}
+
+
+def handle_request(message: dict) -> dict:
+    _refresh()
+    try:
+        if 'argv' in message:
+            return _run_command(message['argv'], env=message['env'], color=message['color'])
+        if 'name' in message:
+            return _resolve_entry_number(message['name'])
+        if 'complete' in message:
+            return _complete(message['complete'], message['incomplete'])
+    except Exception:
+        return FALLBACK
+    return {}
+
+
+def _stop(signum, frame):
+    raise SystemExit(0)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        self.wfile.write(json.dumps(handle_request(message)).encode())
+
+
+def run_server():
+    if request({'ping': True}) is not None:
+        click.echo(f'A diary daemon is already running on {config.SOCKET_PATH}.')
+        return
+
+    config.SOCKET_PATH.unlink(missing_ok=True)
+    config.SOCKET_PATH.parent.mkdir(parents=True, exist_ok=True)
+    disable_forwarding()
+    memo.enable()
+
+    # load everything that typical requests need before accepting them
+    _refresh()
+    if config.DATA_DIR.exists():
+        get_index()
+        get_sorted_entry_names()
+
+    old_umask = os.umask(0o177)
+    try:
+        server = socketserver.UnixStreamServer(str(config.SOCKET_PATH), _RequestHandler)
+    finally:
+        os.umask(old_umask)
+
+    # leave no stale socket behind when stopped with SIGTERM
+    signal.signal(signal.SIGTERM, _stop)
+    click.echo(f'Serving on {config.SOCKET_PATH}, press Ctrl+C to stop.')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        config.SOCKET_PATH.unlink(missing_ok=True)
@@ -2,7 +2,9 @@ from typing import Union
 from datetime import datetime, date
 
 from diary import config
-from diary.entries import get_entry_names
+from diary.client import resolve_entry_number
+from diary.utils.layout import get_entry_dir
+from diary.utils.names import get_sorted_entry_names
 
 
 def today() -> str:
@@ -14,23 +16,31 @@ def get_name(ref: Union[date, int]) -> str:
         return str(ref)
 
     entry_number = ref
-    entry_names = get_entry_names()
+    if (entry_name := resolve_entry_number(entry_number)) is not None:
+        return entry_name
+
+    entry_names = get_sorted_entry_names()
     if entry_number > len(entry_names):
         raise ValueError(f'no entry with number {entry_number}')
-    entry_names.sort(reverse=True)
-    return entry_names[entry_number - 1]
+    return entry_names[-entry_number]
 
 
 def complete_date(ctx, param, incomplete):
-    return [p.stem for p in config.DATA_DIR.iterdir() if p.stem.startswith(incomplete)]
+    return [n for n in get_sorted_entry_names() if n.startswith(incomplete)]
 
 
 def complete_filename(ctx, param, incomplete):
     if not (entry := ctx.params.get('entry')):
         return []
     entry_name = get_name(entry)
-    media_dir = config.DATA_DIR / entry_name / config.MEDIA_SUBDIR_NAME
+    media_dir = get_entry_dir(entry_name) / config.MEDIA_SUBDIR_NAME
     if not media_dir.exists():
         return []
 
     return [p.name for p in media_dir.iterdir() if p.stem.startswith(incomplete)]
+
+
+def complete_tag(ctx, param, incomplete):
+    from diary.utils.entries import get_index
+
+    return [t for t in get_index()['tags'] if t.startswith(incomplete)]
@@ -1,10 +1,10 @@
-import json
 from dataclasses import dataclass
 from typing import Callable, Any
 
 import click
 
 from diary import config
+from diary.utils.entries import save_metadata, read_metadata_file
 from diary.utils.models import Entry, MediaEntry
 
 
@@ -126,6 +126,7 @@ def get_media_updates(metadata: Entry, file_name: str) -> Entry:
 
     if updated_file.file_name != file_name:
         raise UserInputError('cannot change file name')
+    updated_file.digest = file_to_update.digest
 
     new_media = []
     for file in media:
@@ -172,14 +173,10 @@ def prompt_metadata_update(
     metadata_path: str,
     file_name: str = None,
 ):
-    with open(metadata_path, 'r') as f:
-        content = f.read()
-
-    metadata = Entry.from_dict(json.loads(content)) if content else Entry()
+    metadata = read_metadata_file(metadata_path)
     if file_name is not None:
         metadata = get_media_updates(metadata, file_name)
     else:
         metadata = get_entry_updates(metadata)
 
-    with open(metadata_path, 'w') as f:
-        f.write(json.dumps(metadata.to_dict()))
+    save_metadata(metadata_path, metadata)
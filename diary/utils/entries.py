@@ -1,35 +1,52 @@
 from pathlib import Path
+from typing import Iterator
 import json
 
 from diary import config
+from diary.utils.index import (
+    load_index, new_index, save_index, set_index_entry, update_index_entry,
+)
+from diary.utils.layout import get_entry_dir
+from diary.utils.journal import in_batch, get_pending_metadata, record_metadata, write_metadata_file
 from diary.utils.models import Entry, MediaEntry
+from diary.utils.names import invalidate_names_cache
+from diary.utils.storage import get_storage, check_file_ok
+from diary.utils.trace import span, traced
 
 
-def check_file_ok(directory: Path, file: Path = None, create: bool = False) -> bool:
+def iter_entry_names() -> Iterator[str]:
+    return get_storage().iter_names()
 
-    if not create:
-        return directory.exists() and (file is None or file.exists())
 
-    try:
-        directory.mkdir(parents=True, exist_ok=True)
-        if file is not None:
-            file.touch(exist_ok=True)
-    except PermissionError:
-        return False
-    return True
+def entry_exists(entry_name: str) -> bool:
+    return get_storage().exists(entry_name)
 
 
-def get_entry_path(entry_name: str, create: bool = False) -> Path | None:
-    subdirectory = config.DATA_DIR / entry_name
-    filename = subdirectory / config.ENTRY_FILE_NAME
+def create_entry(entry_name: str) -> bool:
+    storage = get_storage()
+    if not storage.exists(entry_name):
+        invalidate_names_cache()
+    return storage.create(entry_name)
 
-    if not check_file_ok(directory=subdirectory, file=filename, create=create):
-        return None
-    return filename
+
+def read_entry_text(entry_name: str) -> str | None:
+    """Read the entry text, None if there is no entry text."""
+
+    return get_storage().read_text(entry_name)
+
+
+def map_entry_text(entry_name: str):
+    """Map the entry text for reading parts of it, see `Storage.map_text`."""
+
+    return get_storage().map_text(entry_name)
 
 
 def get_entry_media_path(entry_name: str, create: bool = False) -> Path | None:
-    subdirectory = config.DATA_DIR / entry_name / config.MEDIA_SUBDIR_NAME
+    if create:
+        if not entry_exists(entry_name):
+            invalidate_names_cache()
+        get_storage().prepare_directory(entry_name)
+    subdirectory = get_entry_dir(entry_name) / config.MEDIA_SUBDIR_NAME
 
     if not check_file_ok(directory=subdirectory, create=create):
         return None
@@ -37,24 +54,73 @@ def get_entry_media_path(entry_name: str, create: bool = False) -> Path | None:
 
 
 def get_metadata_path(entry_name: str, create: bool = False) -> Path | None:
-    subdirectory = config.DATA_DIR / entry_name
-    filename = subdirectory / config.METADATA_FILE_NAME
-
-    if not check_file_ok(directory=subdirectory, file=filename, create=create):
+    """
+    Get the path that identifies the entry metadata in saves and metadata batches.
+
+    It is a real file only with the directory storage.
+    """
+
+    storage = get_storage()
+    if create:
+        if not storage.exists(entry_name):
+            invalidate_names_cache()
+        if not storage.create_metadata(entry_name):
+            return None
+    elif not storage.has_metadata(entry_name):
         return None
-    return filename
+    return get_entry_dir(entry_name) / config.METADATA_FILE_NAME
 
 
 def get_metadata(entry_name: str, create: bool = False) -> Entry | None:
+    if not create:
+        content = get_storage().read_metadata(entry_name)
+        return _parse_metadata(content) if content is not None else None
+
     metadata_path = get_metadata_path(entry_name, create=create)
 
     if metadata_path is None:
         return None
 
-    with open(str(metadata_path), 'r') as f:
-        content = f.read()
+    return read_metadata_file(str(metadata_path))
+
+
+def read_metadata_file(metadata_path: str) -> Entry:
+    if (pending := get_pending_metadata(metadata_path)) is not None:
+        return pending
 
-    return Entry.from_dict(json.loads(content) if content else {})
+    return _parse_metadata(get_storage().read_metadata(Path(metadata_path).parent.name) or '')
+
+
+def _parse_metadata(content: str) -> Entry:
+    with span('metadata.parse'):
+        return Entry.from_dict(json.loads(content) if content else {})
+
+
+@traced('metadata.write')
+def save_metadata(metadata_path: str, metadata: Entry):
+    if in_batch():
+        record_metadata(metadata_path, metadata)
+        return
+
+    write_metadata_file(metadata_path, metadata)
+    update_index_entry(entry_name=Path(metadata_path).parent.name, metadata=metadata)
+
+
+@traced('index.rebuild')
+def rebuild_index() -> dict:
+    index = new_index()
+    for entry_name in iter_entry_names():
+        set_index_entry(index, entry_name=entry_name, metadata=get_metadata(entry_name=entry_name))
+
+    save_index(index)
+    return index
+
+
+def get_index() -> dict:
+    index = load_index()
+    if index is None:
+        index = rebuild_index()
+    return index
 
 
 def update_media_metadata(
@@ -72,10 +138,7 @@ def upsert_metadata(
     metadata_path: str,
     entry_data: Entry
 ):
-    with open(metadata_path, 'r') as f:
-        content = f.read()
-
-    metadata = Entry.from_dict(json.loads(content) if content else {})
+    metadata = read_metadata_file(metadata_path)
     if entry_data.title:
         metadata.title = entry_data.title
     if entry_data.tags:
@@ -88,20 +151,15 @@ def upsert_metadata(
             current=existing_data, update=entry_data.media
         )
 
-    with open(metadata_path, 'w') as f:
-        f.write(json.dumps(metadata.to_dict()))
+    save_metadata(metadata_path, metadata)
 
 
 def remove_file_metadata(metadata_path: str, file_name: str):
-    with open(metadata_path, 'r') as f:
-        content = f.read()
-
-    metadata = Entry.from_dict(json.loads(content) if content else {})
+    metadata = read_metadata_file(metadata_path)
     new_media = []
     for file in metadata.media:
         if file.file_name != file_name:
             new_media.append(file)
     metadata.media = new_media
 
-    with open(metadata_path, 'w') as f:
-        f.write(json.dumps(metadata.to_dict()))
+    save_metadata(metadata_path, metadata)
@@ -0,0 +1,42 @@
+import os
+import threading
+from pathlib import Path
+
+from diary import config
+
+FSYNC_ALWAYS = 'always'
+FSYNC_FILE = 'file'
+FSYNC_NEVER = 'never'
+
+
+def fsync_dir(path: str | Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path: str | Path, content: str | bytes, fsync: str = config.FSYNC_POLICY):
+    """
+    Replace the file at path with content.
+
+    The content is written to a temporary file in the same directory, which is then renamed over the target,
+    so readers and crashes only ever see the old or the new file.
+    """
+
+    path = Path(path)
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    mode = 'wb' if isinstance(content, bytes) else 'w'
+    try:
+        with open(tmp_path, mode) as f:
+            f.write(content)
+            if fsync != FSYNC_NEVER:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    if fsync == FSYNC_ALWAYS:
+        fsync_dir(path.parent)
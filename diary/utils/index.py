@@ -0,0 +1,197 @@
+import marshal
+import os
+
+from diary import config
+from diary.utils.files import atomic_write, FSYNC_NEVER
+from diary.utils.memo import memoized_load
+from diary.utils.models import Entry
+from diary.utils.trace import span, traced
+
+INDEX_VERSION = 2
+
+
+def get_data_dir_mtime() -> int | None:
+    try:
+        return os.stat(config.DATA_DIR).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_storage_backend() -> str:
+    """Get the name of the storage backend in use, caches built from entries are only valid for it."""
+
+    return os.environ.get(config.STORAGE_ENV_VAR) or config.STORAGE_BACKEND
+
+
+def index_record(metadata: Entry | None) -> dict:
+    metadata = metadata or Entry()
+    return {
+        'title': metadata.title,
+        'tags': list(metadata.tags),
+        'media': [m.file_name for m in metadata.media],
+    }
+
+
+def new_index() -> dict:
+    return {
+        'version': INDEX_VERSION,
+        'data_mtime_ns': get_data_dir_mtime(),
+        'storage': get_storage_backend(),
+        'entries': {},
+        'tags': {},
+    }
+
+
+def _update_tag_postings(index: dict, entry_name: str, old_tags: list[str], new_tags: list[str]):
+    postings = index['tags']
+    old_tags = set(old_tags)
+    new_tags = set(new_tags)
+
+    for tag in old_tags - new_tags:
+        names = postings.get(tag, [])
+        if entry_name in names:
+            names.remove(entry_name)
+        if not names:
+            postings.pop(tag, None)
+
+    for tag in new_tags - old_tags:
+        postings.setdefault(tag, []).append(entry_name)
+
+
+def set_index_entry(index: dict, entry_name: str, metadata: Entry | None):
+    record = index_record(metadata)
+    old_record = index['entries'].get(entry_name)
+    old_tags = old_record['tags'] if old_record else []
+
+    index['entries'][entry_name] = record
+    _update_tag_postings(index, entry_name, old_tags=old_tags, new_tags=record['tags'])
+
+
+def _load_index_file(path) -> dict:
+    with span('index.load') as s:
+        with open(path, 'rb') as f:
+            content = f.read()
+        s['bytes'] = len(content)
+        return marshal.loads(content)
+
+
+def _read_stored_index() -> dict | None:
+    try:
+        index = memoized_load(config.INDEX_PATH, _load_index_file)
+    except (FileNotFoundError, ValueError, EOFError, TypeError):
+        return None
+
+    if not isinstance(index, dict) or index.get('version') != INDEX_VERSION:
+        return None
+    if index.get('storage') != get_storage_backend():
+        return None
+    return index
+
+
+def load_index() -> dict | None:
+    index = _read_stored_index()
+    if index is None or index.get('data_mtime_ns') != get_data_dir_mtime():
+        return None
+    return index
+
+
+def save_completion_cache(index: dict):
+    """
+    Write the names, tags and media file names used by `diary.complete`.
+
+    Values are stored as newline separated strings in marshal format,
+    which keeps loading the cache cheap compared to parsing many small objects.
+    Media lines hold the entry name followed by its file names, separated by tabs.
+    """
+
+    entries = index['entries']
+    media_lines = [
+        '\t'.join([name, *record['media']]) for name, record in entries.items() if record['media']
+    ]
+    cache = {
+        'data_mtime_ns': index['data_mtime_ns'],
+        'storage': index['storage'],
+        'default_storage': config.STORAGE_BACKEND,
+        'config_mtime_ns': os.stat(config.CONFIG_PATH).st_mtime_ns,
+        'names': '\n'.join(sorted(entries)),
+        'tags': '\n'.join(sorted(index['tags'])),
+        'media': '\n' + '\n'.join(media_lines) + '\n',
+    }
+    atomic_write(config.COMPLETION_CACHE_PATH, marshal.dumps(cache), fsync=FSYNC_NEVER)
+
+
+@traced('index.save')
+def save_index(index: dict):
+    config.INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+    atomic_write(config.INDEX_PATH, marshal.dumps(index), fsync=FSYNC_NEVER)
+
+    save_completion_cache(index)
+
+
+def drop_index():
+    try:
+        os.remove(config.INDEX_PATH)
+    except FileNotFoundError:
+        pass
+
+
+def accept_data_dir_change(previous_mtime: int | None):
+    """Keep an up to date index valid across a data directory change that left entry metadata as it was."""
+
+    index = _read_stored_index()
+    if index is None or index.get('data_mtime_ns') != previous_mtime:
+        return
+
+    index['data_mtime_ns'] = get_data_dir_mtime()
+    save_index(index)
+
+
+def update_index_entries(updates: dict[str, Entry | None]):
+    """
+    Store metadata of several entries in the index with a single write.
+
+    A missing index is left alone, it is rebuilt on the next read.
+    Adding a new entry changes the data directory mtime, which is accepted;
+    a changed mtime for a known entry means the directory was changed
+    outside of the tool, so the index is dropped instead.
+    """
+
+    index = _read_stored_index()
+    if index is None or not updates:
+        return
+
+    entries = index['entries']
+    data_mtime = get_data_dir_mtime()
+    if index.get('data_mtime_ns') != data_mtime and all(name in entries for name in updates):
+        drop_index()
+        return
+
+    for entry_name, metadata in updates.items():
+        set_index_entry(index, entry_name=entry_name, metadata=metadata)
+    index['data_mtime_ns'] = data_mtime
+    save_index(index)
+
+
+def update_index_entry(entry_name: str, metadata: Entry | None):
+    update_index_entries({entry_name: metadata})
+
+
+def remove_index_entry(entry_name: str):
+    index = _read_stored_index()
+    if index is None:
+        return
+
+    if (record := index['entries'].pop(entry_name, None)) is None:
+        drop_index()
+        return
+
+    _update_tag_postings(index, entry_name, old_tags=record['tags'], new_tags=[])
+    index['data_mtime_ns'] = get_data_dir_mtime()
+    save_index(index)
+
+
+def get_tag_postings(index: dict, tags: set[str]) -> set[str]:
+    entry_names = set()
+    for tag in tags:
+        entry_names.update(index['tags'].get(tag, []))
+    return entry_names
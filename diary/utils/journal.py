@@ -0,0 +1,150 @@
+"""
+Write-ahead journal for batched metadata updates.
+
+Inside `metadata_batch()`, metadata saves are appended to the journal and kept in memory
+instead of rewriting each `meta.json`. When the batch ends, the last state of every touched
+metadata file is written once, the index is updated once and the journal is removed.
+If the process dies before that, `replay_journal()` applies the journaled updates on the next start.
+
+The batch holds an exclusive `flock` on the journal from start to end, so other processes
+replay only a journal whose owner is gone and wait for the lock before starting a batch.
+
+Outside of batches metadata files are replaced atomically one by one.
+"""
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from diary import config
+from diary.utils.files import fsync_dir, FSYNC_ALWAYS, FSYNC_NEVER
+from diary.utils.index import update_index_entries
+from diary.utils.models import Entry
+from diary.utils.storage import get_storage
+
+_lock = threading.Lock()
+_batch: dict[str, Entry] | None = None
+_journal = None
+
+
+def write_metadata_file(metadata_path: str, metadata: Entry):
+    get_storage().write_metadata(Path(metadata_path).parent.name, json.dumps(metadata.to_dict()))
+
+
+def _commit(updates: dict[str, Entry]):
+    with get_storage().transaction():
+        for metadata_path, metadata in updates.items():
+            write_metadata_file(metadata_path, metadata)
+
+    if config.FSYNC_POLICY == FSYNC_ALWAYS:
+        for directory in {Path(p).parent for p in updates}:
+            if directory.exists():
+                fsync_dir(directory)
+
+    update_index_entries({Path(p).parent.name: m for p, m in updates.items()})
+
+
+def in_batch() -> bool:
+    return _batch is not None
+
+
+def get_pending_metadata(metadata_path: str) -> Entry | None:
+    if _batch is None:
+        return None
+    with _lock:
+        return _batch.get(metadata_path)
+
+
+def record_metadata(metadata_path: str, metadata: Entry):
+    line = json.dumps({'path': metadata_path, 'metadata': metadata.to_dict()}) + '\n'
+    with _lock:
+        _journal.write(line)
+        _journal.flush()
+        if config.FSYNC_POLICY != FSYNC_NEVER:
+            os.fsync(_journal.fileno())
+        _batch[metadata_path] = metadata
+
+
+def _open_locked(blocking: bool):
+    """Open the journal with an exclusive lock, None if another process holds the lock."""
+
+    while True:
+        journal = open(config.JOURNAL_PATH, 'a+')
+        try:
+            fcntl.flock(journal.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            journal.close()
+            return None
+
+        # the previous owner removes the journal before releasing the lock, the lock is then taken again
+        try:
+            if os.stat(config.JOURNAL_PATH).st_ino == os.fstat(journal.fileno()).st_ino:
+                return journal
+        except FileNotFoundError:
+            pass
+        journal.close()
+
+
+def _replay(journal) -> int:
+    journal.seek(0)
+    updates = {}
+    for line in journal:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # a torn write at the end of the journal
+            continue
+        updates[record['path']] = Entry.from_dict(record['metadata'])
+
+    storage = get_storage()
+    updates = {p: m for p, m in updates.items() if storage.exists(Path(p).parent.name)}
+    _commit(updates)
+    return len(updates)
+
+
+@contextmanager
+def metadata_batch():
+    """Group metadata saves into one compacted write per metadata file."""
+
+    global _batch, _journal
+
+    if _batch is not None:
+        yield
+        return
+
+    config.JOURNAL_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with _open_locked(blocking=True) as journal:
+        # updates of a batch whose process died, nothing else holds the journal now
+        _replay(journal)
+        journal.truncate(0)
+
+        _batch, _journal = {}, journal
+        try:
+            yield
+        finally:
+            # saves that reached the journal are kept even if the batch was interrupted
+            updates, _batch, _journal = _batch, None, None
+            _commit(updates)
+            config.JOURNAL_PATH.unlink(missing_ok=True)
+
+
+def replay_journal() -> int:
+    """
+    Apply updates left in the journal by an interrupted batch, return the number of updated files.
+
+    The journal of a batch that is still running is left to it.
+    """
+
+    try:
+        journal = _open_locked(blocking=False)
+    except FileNotFoundError:
+        return 0
+    if journal is None:
+        return 0
+
+    with journal:
+        count = _replay(journal)
+        config.JOURNAL_PATH.unlink(missing_ok=True)
+    return count
@@ -0,0 +1,173 @@
+"""
+Placement of entry directories under `config.DATA_DIR`.
+
+The flat layout keeps every entry directly in the data directory (`data/2024-05-17/`),
+the sharded layout nests entries by year and month (`data/2024/05/2024-05-17/`).
+The layout of a data directory is recorded in its `.layout` file and defaults to
+`config.DATA_LAYOUT`. Entries are also looked up in the other layout, so a diary
+stays usable while `diary migrate-layout` moves its entries.
+
+Caches are validated against the data directory mtime, which does not change when
+a sharded entry is added or removed, so those changes touch the data directory.
+Changes to files of an existing entry do not show in it either, they are logged
+with `note_entry_change`.
+"""
+import os
+import shutil
+from pathlib import Path
+
+from diary import config
+from diary.utils.files import atomic_write
+
+FLAT = 'flat'
+SHARDED = 'sharded'
+LAYOUTS = (FLAT, SHARDED)
+# the change log is started over past this size, which makes its readers walk the data directory once
+CHANGE_LOG_LIMIT = 1024 * 1024
+
+_layout = None
+
+
+def get_layout() -> str:
+    global _layout
+
+    if _layout is None:
+        try:
+            with open(config.DATA_DIR / config.LAYOUT_FILE_NAME, 'r') as f:
+                _layout = f.read().strip()
+        except FileNotFoundError:
+            _layout = config.DATA_LAYOUT
+    return _layout
+
+
+def reset_layout():
+    global _layout
+    _layout = None
+
+
+def set_layout(layout: str):
+    global _layout
+
+    config.DATA_DIR.mkdir(parents=True, exist_ok=True)
+    atomic_write(config.DATA_DIR / config.LAYOUT_FILE_NAME, layout + '\n')
+    _layout = layout
+
+
+def _is_shardable(entry_name: str) -> bool:
+    return len(entry_name) == 10 and entry_name[4] == '-' and entry_name[7] == '-'
+
+
+def get_layout_dir(entry_name: str, layout: str) -> Path:
+    if layout == SHARDED and _is_shardable(entry_name):
+        return config.DATA_DIR / entry_name[:4] / entry_name[5:7] / entry_name
+    return config.DATA_DIR / entry_name
+
+
+def get_entry_dir(entry_name: str) -> Path:
+    """Get the directory of an entry, which does not have to exist."""
+
+    layout = get_layout()
+    entry_dir = get_layout_dir(entry_name, layout)
+    if entry_dir.exists():
+        return entry_dir
+
+    other_dir = get_layout_dir(entry_name, FLAT if layout == SHARDED else SHARDED)
+    return other_dir if other_dir != entry_dir and other_dir.exists() else entry_dir
+
+
+def touch_data_dir():
+    config.DATA_DIR.mkdir(parents=True, exist_ok=True)
+    os.utime(config.DATA_DIR)
+
+
+def note_entry_change(entry_name: str):
+    """Log an entry whose text or media files were changed in place, for `diary.utils.manifest`."""
+
+    config.CHANGE_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(config.CHANGE_LOG_PATH, 'a') as f:
+        f.write(entry_name + '\n')
+        size = f.tell()
+    if size > CHANGE_LOG_LIMIT:
+        config.CHANGE_LOG_PATH.unlink(missing_ok=True)
+
+
+def make_entry_dir(entry_name: str) -> Path:
+    entry_dir = get_entry_dir(entry_name)
+    if not entry_dir.exists():
+        entry_dir.mkdir(parents=True, exist_ok=True)
+        if entry_dir.parent != config.DATA_DIR:
+            touch_data_dir()
+    return entry_dir
+
+
+def _prune_shards(entry_dir: Path):
+    for shard_dir in (entry_dir.parent, entry_dir.parent.parent):
+        if shard_dir == config.DATA_DIR:
+            return
+        try:
+            shard_dir.rmdir()
+        except OSError:
+            return
+
+
+def remove_entry_dir(entry_name: str):
+    entry_dir = get_entry_dir(entry_name)
+    shutil.rmtree(entry_dir)
+    if entry_dir.parent != config.DATA_DIR:
+        _prune_shards(entry_dir)
+        touch_data_dir()
+
+
+def _in_range(name: str, since: str = None, until: str = None) -> bool:
+    return (not since or name >= since[:len(name)]) and (not until or name <= until[:len(name)])
+
+
+def _scan_dirs(path: Path):
+    try:
+        with os.scandir(path) as it:
+            return [d for d in it if d.is_dir() and not d.name.startswith('.')]
+    except FileNotFoundError:
+        return []
+
+
+def iter_entry_dirs(since: str = None, until: str = None):
+    """
+    Yield names and directories of entries between two dates (inclusive, either may be None).
+
+    Year and month directories outside the range are not scanned.
+    """
+
+    for dir_entry in _scan_dirs(config.DATA_DIR):
+        if not (len(dir_entry.name) == 4 and dir_entry.name.isdigit()):
+            if _in_range(dir_entry.name, since, until):
+                yield dir_entry.name, Path(dir_entry.path)
+            continue
+
+        if not _in_range(dir_entry.name, since, until):
+            continue
+        for month_entry in _scan_dirs(dir_entry.path):
+            if not _in_range(f'{dir_entry.name}-{month_entry.name}', since, until):
+                continue
+            for entry in _scan_dirs(month_entry.path):
+                if _in_range(entry.name, since, until):
+                    yield entry.name, Path(entry.path)
+
+
+def migrate_layout(layout: str) -> int:
+    """Move entry directories into the given layout one by one, return the number of moved entries."""
+
+    set_layout(layout)
+    moved = 0
+    for entry_name, entry_dir in list(iter_entry_dirs()):
+        target_dir = get_layout_dir(entry_name, layout)
+        if entry_dir == target_dir:
+            continue
+
+        target_dir.parent.mkdir(parents=True, exist_ok=True)
+        os.rename(entry_dir, target_dir)
+        if entry_dir.parent != config.DATA_DIR:
+            _prune_shards(entry_dir)
+        moved += 1
+
+    touch_data_dir()
+    return moved
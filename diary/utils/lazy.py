@@ -0,0 +1,30 @@
+import importlib
+
+import click
+
+
+class LazyGroup(click.Group):
+    """
+    A group that imports some of its subcommands only when they are used.
+
+    `lazy_subcommands` maps command names to import paths like `package.module.command`.
+    """
+
+    def __init__(self, *args, lazy_subcommands: dict[str, str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx):
+        return sorted([*super().list_commands(ctx), *self.lazy_subcommands])
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy_subcommands:
+            return self._lazy_load(cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def _lazy_load(self, cmd_name):
+        module_name, command_name = self.lazy_subcommands[cmd_name].rsplit('.', 1)
+        command = getattr(importlib.import_module(module_name), command_name)
+        if not isinstance(command, click.Command):
+            raise ValueError(f'lazy loading of {cmd_name} did not return a click command')
+        return command
@@ -0,0 +1,265 @@
+"""
+Change detection over the data directory.
+
+A manifest maps entry names to the mtime and size of their files, keyed by the path
+relative to the entry directory (`entry.txt`, `meta.json`, `media/<name>`).
+`scan_manifest` builds one with a single `os.scandir` walk and no file reads,
+and `diff_manifests` compares it with a manifest saved by an earlier run, so caches
+can find entries changed by any program, including an editor, without reading them.
+Packed entries are listed with the mtime and sizes recorded in their pack index.
+With the sqlite storage, entry texts are listed with the mtime and size recorded
+in the database, and only media files are taken from the data directory.
+
+A walk still stats every file, so `scan_changes` first compares the change signal saved
+with the manifest: the data and packs directory mtimes, which change when entries are added,
+removed or packed, and the change log of entries diary changed in place (`note_entry_change`).
+With the same signal nothing is walked, and when only the log grew, only the logged entries are.
+Files changed in place by other programs are found by a full walk, done at least once
+every `config.CHANGE_SCAN_INTERVAL` seconds.
+"""
+import marshal
+import os
+import time
+from dataclasses import dataclass, field
+
+from diary import config
+from diary.utils.files import atomic_write, FSYNC_NEVER
+from diary.utils.index import get_storage_backend
+from diary.utils.layout import iter_entry_dirs, get_entry_dir
+from diary.utils.packs import iter_packed_names, get_packed_record, TEXT, META
+from diary.utils.storage import get_storage, SQLITE
+from diary.utils.trace import traced
+
+MANIFEST_VERSION = 2
+MEDIA_PREFIX = config.MEDIA_SUBDIR_NAME + '/'
+
+Manifest = dict[str, dict[str, list[int]]]
+
+
+@dataclass(slots=True)
+class ManifestDiff:
+    added: list[str] = field(default_factory=list)
+    modified: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    added_media: list[str] = field(default_factory=list)
+    modified_media: list[str] = field(default_factory=list)
+    removed_media: list[str] = field(default_factory=list)
+
+    def __bool__(self):
+        return any((
+            self.added, self.modified, self.removed, self.added_media, self.modified_media, self.removed_media
+        ))
+
+
+def _scan_files(path: str, prefix: str, files: dict[str, list[int]], media_only: bool):
+    try:
+        with os.scandir(path) as it:
+            for dir_entry in it:
+                if dir_entry.name.startswith('.'):
+                    continue
+                if dir_entry.is_file():
+                    if prefix or not media_only:
+                        stat = dir_entry.stat()
+                        files[prefix + dir_entry.name] = [stat.st_mtime_ns, stat.st_size]
+                elif not prefix and dir_entry.name == config.MEDIA_SUBDIR_NAME and dir_entry.is_dir():
+                    _scan_files(dir_entry.path, MEDIA_PREFIX, files, media_only)
+    except FileNotFoundError:
+        pass
+
+
+def _in_range(entry_name: str, since: str = None, until: str = None) -> bool:
+    return (not since or entry_name >= since) and (not until or entry_name <= until)
+
+
+@traced('manifest.scan')
+def scan_manifest(since: str = None, until: str = None, entry_names: set[str] = None) -> Manifest:
+    """
+    Get the manifest of entries between two dates (inclusive, either may be None).
+
+    With entry_names, only those entries are looked up instead of walking the data directory.
+    """
+
+    storage = get_storage()
+    media_only = storage.name == SQLITE
+
+    if entry_names is None:
+        entry_dirs = iter_entry_dirs(since=since, until=until)
+    else:
+        entry_dirs = [(n, entry_dir) for n in sorted(entry_names) if (entry_dir := get_entry_dir(n)).is_dir()]
+
+    manifest = {}
+    for entry_name, entry_dir in entry_dirs:
+        files = {}
+        _scan_files(str(entry_dir), '', files, media_only)
+        if files or not media_only:
+            manifest[entry_name] = files
+
+    if media_only:
+        if entry_names is None:
+            text_stats = storage.iter_text_stats(since=since, until=until)
+        else:
+            text_stats = ((n, *stat) for n in entry_names if (stat := storage.stat_text(n)) is not None)
+        for entry_name, mtime_ns, size in text_stats:
+            manifest.setdefault(entry_name, {})[config.ENTRY_FILE_NAME] = [mtime_ns, size]
+        return manifest
+
+    for entry_name in iter_packed_names() if entry_names is None else entry_names:
+        if entry_name in manifest or not _in_range(entry_name, since, until):
+            continue
+        if (record := get_packed_record(entry_name)) is None:
+            continue
+        manifest[entry_name] = {
+            file_name: [record['mtime_ns'], record[part][1]]
+            for part, file_name in ((TEXT, config.ENTRY_FILE_NAME), (META, config.METADATA_FILE_NAME))
+            if record[part] is not None
+        }
+    return manifest
+
+
+def diff_manifests(old: Manifest, new: Manifest) -> ManifestDiff:
+    diff = ManifestDiff()
+    for entry_name in sorted(old.keys() | new.keys()):
+        old_files = old.get(entry_name)
+        new_files = new.get(entry_name)
+        if old_files is None:
+            diff.added.append(entry_name)
+        elif new_files is None:
+            diff.removed.append(entry_name)
+
+        old_files = old_files or {}
+        new_files = new_files or {}
+        entry_changed = False
+        for file_key in sorted(old_files.keys() | new_files.keys()):
+            old_stat = old_files.get(file_key)
+            new_stat = new_files.get(file_key)
+            if old_stat == new_stat:
+                continue
+
+            if not file_key.startswith(MEDIA_PREFIX):
+                entry_changed = True
+                continue
+            media_name = f'{entry_name}/{file_key[len(MEDIA_PREFIX):]}'
+            if old_stat is None:
+                diff.added_media.append(media_name)
+            elif new_stat is None:
+                diff.removed_media.append(media_name)
+            else:
+                diff.modified_media.append(media_name)
+
+        if entry_changed and entry_name in old and entry_name in new:
+            diff.modified.append(entry_name)
+    return diff
+
+
+def _get_mtime(path) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_change_signal() -> dict:
+    """Get the cheap summary of changes to the data directory that manifests are saved with."""
+
+    try:
+        stat = os.stat(config.CHANGE_LOG_PATH)
+        log = [stat.st_ino, stat.st_size]
+    except FileNotFoundError:
+        log = None
+    return {
+        'data_mtime_ns': _get_mtime(config.DATA_DIR),
+        'packs_mtime_ns': _get_mtime(config.PACKS_DIR),
+        'log': log,
+    }
+
+
+def _read_logged_names(old_signal: dict, signal: dict) -> set[str] | None:
+    """Get the entries logged between two change signals, None if more than the log changed."""
+
+    if old_signal['data_mtime_ns'] != signal['data_mtime_ns'] or old_signal['packs_mtime_ns'] != signal['packs_mtime_ns']:
+        return None
+
+    old_log, log = old_signal['log'], signal['log']
+    if log is None or (old_log is not None and (old_log[0] != log[0] or old_log[1] > log[1])):
+        # the log was started over since the old signal
+        return None
+
+    start = old_log[1] if old_log else 0
+    try:
+        with open(config.CHANGE_LOG_PATH, 'r') as f:
+            f.seek(start)
+            return set(f.read(log[1] - start).split())
+    except FileNotFoundError:
+        return None
+
+
+def _read_manifest_file(path, entries: bool) -> tuple[dict, Manifest | None] | None:
+    try:
+        with open(path, 'rb') as f:
+            state = marshal.load(f)
+            if state.get('version') != MANIFEST_VERSION or state.get('storage') != get_storage_backend():
+                return None
+            # marshal.load reads a file in small pieces, which is only cheap for the header
+            return state, marshal.loads(f.read()) if entries else None
+    except (FileNotFoundError, ValueError, EOFError, TypeError, AttributeError):
+        return None
+
+
+def load_manifest_state(path) -> dict | None:
+    """Load the change signal and time of the last walk saved with a manifest, reading only them."""
+
+    content = _read_manifest_file(path, entries=False)
+    return content[0] if content else None
+
+
+def load_manifest(path) -> Manifest:
+    """Load a saved manifest, an empty one if it is missing or outdated."""
+
+    content = _read_manifest_file(path, entries=True)
+    return content[1] if content else {}
+
+
+def save_manifest(path, manifest: Manifest, state: dict):
+    """Save a manifest after the state, so that `load_manifest_state` does not have to read the entries."""
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    state = {**state, 'version': MANIFEST_VERSION, 'storage': get_storage_backend()}
+    atomic_write(path, marshal.dumps(state) + marshal.dumps(manifest), fsync=FSYNC_NEVER)
+
+
+def remove_manifest(path):
+    """Make the next `scan_changes` report every entry as added, for a cache that starts over."""
+
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@traced('manifest.changes')
+def scan_changes(path) -> tuple[ManifestDiff, Manifest | None, dict]:
+    """
+    Diff the data directory against the manifest saved at path.
+
+    The new manifest and its state are returned rather than saved, so a caller can save
+    them with `save_manifest` once it has processed the changes. When the change signal
+    shows that nothing changed since the saved manifest, no manifest is returned.
+    """
+
+    signal = get_change_signal()
+    now = time.time()
+    state = load_manifest_state(path)
+    fresh = state is not None and now - state['scanned_at'] < config.CHANGE_SCAN_INTERVAL
+    if fresh and state['signal'] == signal:
+        return ManifestDiff(), None, state
+
+    old = load_manifest(path) if state is not None else {}
+    if not fresh or (entry_names := _read_logged_names(state['signal'], signal)) is None:
+        manifest = scan_manifest()
+        return diff_manifests(old, manifest), manifest, {'signal': signal, 'scanned_at': now}
+
+    changed = scan_manifest(entry_names=entry_names)
+    diff = diff_manifests({n: old[n] for n in entry_names if n in old}, changed)
+    manifest = {n: files for n, files in old.items() if n not in entry_names}
+    manifest.update(changed)
+    return diff, manifest, {'signal': signal, 'scanned_at': state['scanned_at']}
@@ -0,0 +1,38 @@
+"""
+In-process memoization of cache file reads for the resident daemon (`diary serve`).
+
+Loaded values are kept together with the file mtime, size and inode and reused until
+the file is replaced. Short-lived CLI invocations read each file at most a few times,
+so memoization is off unless the daemon enables it. The daemon answers one request
+at a time, and the completion fast path imports this module, so it does without locks
+and imports nothing but `os`.
+"""
+import os
+
+_enabled = False
+_values: dict[str, tuple] = {}
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def clear():
+    _values.clear()
+
+
+def memoized_load(path: str | os.PathLike, load):
+    """Load a file with `load(path)`, reusing the last loaded value while the file is unchanged."""
+
+    if not _enabled:
+        return load(path)
+
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    if (memo := _values.get(str(path))) is not None and memo[0] == key:
+        return memo[1]
+
+    value = load(path)
+    _values[str(path)] = (key, value)
+    return value
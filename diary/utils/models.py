@@ -1,20 +1,48 @@
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field
 
+SCHEMA_VERSION = 1
 
-@dataclass
+
+def _migrate_v0(data: dict) -> dict:
+    # v1 added the version field and optional media digests
+    return {**data, 'version': 1}
+
+
+# Metadata written by older versions is migrated step by step when it is read
+# and saved in the current schema the next time it is written.
+MIGRATIONS = {
+    0: _migrate_v0,
+}
+
+
+def migrate(data: dict) -> dict:
+    version = data.get('version', 0)
+    if version > SCHEMA_VERSION:
+        raise ValueError(f'unsupported metadata schema version {version}')
+
+    while version < SCHEMA_VERSION:
+        data = MIGRATIONS[version](data)
+        version = data['version']
+    return data
+
+
+@dataclass(slots=True)
 class MediaEntry:
     file_name: str
     description: str = None
+    digest: str = None
 
     @classmethod
     def from_dict(cls, data: dict):
-        return cls(**data)
+        if 'file_name' not in data:
+            raise TypeError("missing required field 'file_name'")
+        return cls(data['file_name'], data.get('description'), data.get('digest'))
 
     def to_dict(self):
-        return asdict(self)
+        return {'file_name': self.file_name, 'description': self.description, 'digest': self.digest}
 
 
-@dataclass
+@dataclass(slots=True)
 class Entry:
     title: str = None
     tags: list[str] = field(default_factory=list)
@@ -22,10 +50,18 @@ class Entry:
 
     @classmethod
     def from_dict(cls, data: dict):
-        media = data.pop('media', [])
-        media_entries = [MediaEntry.from_dict(m) for m in media]
-        data['media'] = media_entries
-        return cls(**data)
+        data = migrate(data)
+        media_from_dict = MediaEntry.from_dict
+        return cls(
+            data.get('title'),
+            list(data.get('tags') or []),
+            [media_from_dict(m) for m in data.get('media') or []],
+        )
 
     def to_dict(self):
-        return asdict(self)
+        return {
+            'version': SCHEMA_VERSION,
+            'title': self.title,
+            'tags': list(self.tags),
+            'media': [m.to_dict() for m in self.media],
+        }
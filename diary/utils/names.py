@@ -0,0 +1,73 @@
+import bisect
+import json
+import os
+
+from diary import config
+from diary.utils.files import atomic_write, FSYNC_NEVER
+from diary.utils.index import get_data_dir_mtime, get_storage_backend
+from diary.utils.memo import memoized_load
+from diary.utils.storage import get_storage
+from diary.utils.trace import traced
+
+
+@traced('fs.listdir')
+def _scan_entry_names(since: str = None, until: str = None) -> list[str]:
+    return sorted(get_storage().iter_names(since=since, until=until))
+
+
+def invalidate_names_cache():
+    try:
+        os.remove(config.NAMES_CACHE_PATH)
+    except FileNotFoundError:
+        pass
+
+
+def _read_json(path) -> dict:
+    with open(path, 'r') as f:
+        return json.loads(f.read())
+
+
+def _load_names_cache(data_mtime: int | None) -> list[str] | None:
+    try:
+        cache = memoized_load(config.NAMES_CACHE_PATH, _read_json)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if cache.get('data_mtime_ns') != data_mtime or cache.get('storage') != get_storage_backend():
+        return None
+    return cache['names']
+
+
+@traced('names.load')
+def get_sorted_entry_names() -> list[str]:
+    """
+    Get entry names in ascending order.
+
+    The sorted listing is cached on disk together with the data directory mtime,
+    and the directory is only scanned again when the mtime no longer matches.
+    """
+
+    data_mtime = get_data_dir_mtime()
+    if (names := _load_names_cache(data_mtime)) is not None:
+        return names
+
+    names = _scan_entry_names()
+    config.NAMES_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    cache = {'data_mtime_ns': data_mtime, 'storage': get_storage_backend(), 'names': names}
+    atomic_write(config.NAMES_CACHE_PATH, json.dumps(cache, separators=(',', ':')), fsync=FSYNC_NEVER)
+    return names
+
+
+def get_entry_names_range(since: str = None, until: str = None) -> list[str]:
+    """
+    Get entry names between two dates (inclusive, either may be None) in ascending order.
+
+    Without an up to date names cache only the directories in the range are scanned.
+    """
+
+    if (names := _load_names_cache(get_data_dir_mtime())) is None:
+        return _scan_entry_names(since=since, until=until)
+
+    start = bisect.bisect_left(names, since) if since else 0
+    end = bisect.bisect_right(names, until) if until else len(names)
+    return names[start:end]
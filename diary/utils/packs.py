@@ -0,0 +1,214 @@
+"""
+Append-only pack files for closed years.
+
+`diary pack YEAR` moves the entry and metadata files of a year into `YEAR.pack` under
+`config.PACKS_DIR` and records their offsets in `YEAR.idx`. Packed entries are read through
+`mmap` without unpacking them; anything that needs a file path unpacks the entry back into
+its directory first. Unpacking only drops the entry from the pack index, the pack itself
+is never rewritten. An entry directory always takes precedence over a packed copy.
+"""
+import json
+import mmap
+import os
+import threading
+
+from diary import config
+from diary.utils.files import atomic_write, fsync_dir, FSYNC_ALWAYS, FSYNC_NEVER
+from diary.utils.layout import get_entry_dir, make_entry_dir, remove_entry_dir
+from diary.utils.trace import span, traced
+
+PACK_INDEX_VERSION = 1
+TEXT = 'text'
+META = 'meta'
+
+_lock = threading.Lock()
+_indexes: dict[str, dict] = {}
+_maps: dict[str, mmap.mmap] = {}
+
+
+def get_pack_path(year: str):
+    return config.PACKS_DIR / f'{year}.pack'
+
+
+def get_pack_index_path(year: str):
+    return config.PACKS_DIR / f'{year}.idx'
+
+
+def _new_pack_index() -> dict:
+    return {'version': PACK_INDEX_VERSION, 'entries': {}}
+
+
+def load_pack_index(year: str) -> dict:
+    with _lock:
+        if (index := _indexes.get(year)) is not None:
+            return index
+
+        try:
+            with open(get_pack_index_path(year), 'r') as f:
+                index = json.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            index = _new_pack_index()
+        if index.get('version') != PACK_INDEX_VERSION:
+            index = _new_pack_index()
+
+        _indexes[year] = index
+        return index
+
+
+def _save_pack_index(year: str, index: dict):
+    atomic_write(get_pack_index_path(year), json.dumps(index, separators=(',', ':')))
+    with _lock:
+        _indexes[year] = index
+
+
+def _close_map(year: str):
+    with _lock:
+        if (pack_map := _maps.pop(year, None)) is not None:
+            pack_map.close()
+
+
+def clear_pack_cache():
+    """Forget loaded pack indexes and maps, for processes that outlive changes made by others."""
+
+    with _lock:
+        _indexes.clear()
+        for pack_map in _maps.values():
+            pack_map.close()
+        _maps.clear()
+
+
+def _get_map(year: str) -> mmap.mmap:
+    with _lock:
+        if (pack_map := _maps.get(year)) is None:
+            with open(get_pack_path(year), 'rb') as f:
+                pack_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            _maps[year] = pack_map
+        return pack_map
+
+
+def iter_pack_years():
+    try:
+        with os.scandir(config.PACKS_DIR) as it:
+            for dir_entry in it:
+                if dir_entry.name.endswith('.idx'):
+                    yield dir_entry.name[:-len('.idx')]
+    except FileNotFoundError:
+        return
+
+
+def iter_packed_names():
+    for year in iter_pack_years():
+        yield from load_pack_index(year)['entries']
+
+
+def get_packed_record(entry_name: str) -> dict | None:
+    if not config.PACKS_DIR.exists():
+        return None
+    return load_pack_index(entry_name[:4])['entries'].get(entry_name)
+
+
+def get_packed_range(entry_name: str, part: str) -> tuple[mmap.mmap, int, int] | None:
+    """Get the pack map and the start and end offsets of a packed entry part, None if it is not packed."""
+
+    record = get_packed_record(entry_name)
+    if record is None or record.get(part) is None:
+        return None
+
+    offset, size = record[part]
+    if not size:
+        return b'', 0, 0
+    return _get_map(entry_name[:4]), offset, offset + size
+
+
+def read_packed(entry_name: str, part: str) -> bytes | None:
+    """Read a packed entry part, None if the entry or the part is not packed."""
+
+    if (packed_range := get_packed_range(entry_name, part)) is None:
+        return None
+
+    pack_map, start, end = packed_range
+    with span('pack.read') as s:
+        data = pack_map[start:end]
+        s['bytes'] = len(data)
+    return data
+
+
+def _read_file(path) -> bytes | None:
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+@traced('pack.write')
+def pack_entries(year: str, entry_names: list[str]) -> list[str]:
+    """
+    Append entries to the year pack and remove their directories, return the packed names.
+
+    Entries with media files are left in place.
+    """
+
+    config.PACKS_DIR.mkdir(parents=True, exist_ok=True)
+    index = load_pack_index(year)
+    entries = dict(index['entries'])
+
+    packed = []
+    pack_path = get_pack_path(year)
+    with open(pack_path, 'ab') as pack:
+        offset = pack.tell()
+        for entry_name in entry_names:
+            entry_dir = get_entry_dir(entry_name)
+            media_dir = entry_dir / config.MEDIA_SUBDIR_NAME
+            if media_dir.exists() and any(media_dir.iterdir()):
+                continue
+
+            text_path = entry_dir / config.ENTRY_FILE_NAME
+            record = {'mtime_ns': text_path.stat().st_mtime_ns if text_path.exists() else 0}
+            for part, file_name in ((TEXT, config.ENTRY_FILE_NAME), (META, config.METADATA_FILE_NAME)):
+                if (content := _read_file(entry_dir / file_name)) is None:
+                    record[part] = None
+                    continue
+                pack.write(content)
+                record[part] = [offset, len(content)]
+                offset += len(content)
+
+            entries[entry_name] = record
+            packed.append(entry_name)
+
+        if config.FSYNC_POLICY != FSYNC_NEVER:
+            pack.flush()
+            os.fsync(pack.fileno())
+
+    _close_map(year)
+    _save_pack_index(year, {**index, 'entries': entries})
+
+    for entry_name in packed:
+        remove_entry_dir(entry_name)
+    if config.FSYNC_POLICY == FSYNC_ALWAYS:
+        fsync_dir(config.DATA_DIR)
+    return packed
+
+
+@traced('pack.unpack')
+def unpack_entry(entry_name: str) -> bool:
+    """Restore a packed entry into its directory and drop it from the pack index."""
+
+    record = get_packed_record(entry_name)
+    if record is None:
+        return False
+
+    entry_dir = make_entry_dir(entry_name)
+    for part, file_name in ((TEXT, config.ENTRY_FILE_NAME), (META, config.METADATA_FILE_NAME)):
+        if (content := read_packed(entry_name, part)) is not None:
+            file_path = entry_dir / file_name
+            atomic_write(file_path, content)
+            if part == TEXT:
+                os.utime(file_path, ns=(record['mtime_ns'], record['mtime_ns']))
+
+    year = entry_name[:4]
+    index = load_pack_index(year)
+    entries = dict(index['entries'])
+    entries.pop(entry_name, None)
+    _save_pack_index(year, {**index, 'entries': entries})
+    return True
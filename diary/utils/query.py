@@ -0,0 +1,146 @@
+"""
+Boolean tag queries for `diary list -q`.
+
+A query combines tags with AND, OR, NOT and parentheses, for example
+`work AND (travel OR conf) AND NOT draft`. Adjacent terms are joined with AND,
+operators are case-insensitive and tags with spaces can be quoted.
+Queries are evaluated over bitsets of the tag postings in the index,
+with entries numbered by their sorted position, so no metadata files are read.
+"""
+import re
+
+TOKEN_PATTERN = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|([^\s()"]+))')
+OPERATORS = {'AND', 'OR', 'NOT'}
+
+TAG = 'tag'
+AND = 'and'
+OR = 'or'
+NOT = 'not'
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+def _tokenize(text: str) -> list[tuple[str, str]]:
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        if (match := TOKEN_PATTERN.match(text, position)) is None:
+            raise QuerySyntaxError(f'unexpected {text[position:].strip()!r}')
+        position = match.end()
+
+        opening, closing, quoted, word = match.groups()
+        if opening or closing:
+            tokens.append((opening or closing, ''))
+        elif quoted is not None:
+            tokens.append((TAG, quoted))
+        elif word.upper() in OPERATORS:
+            tokens.append((word.upper(), ''))
+        else:
+            tokens.append((TAG, word))
+    return tokens
+
+
+class _Parser:
+    """Recursive descent over `or: and (OR and)*`, `and: not (AND? not)*`, `not: NOT not | ( or ) | tag`."""
+
+    def __init__(self, tokens: list[tuple[str, str]]):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self) -> str | None:
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def take(self) -> tuple[str, str]:
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self) -> tuple:
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise QuerySyntaxError(f'unexpected {self.tokens[self.position][1] or self.peek()!r}')
+        return node
+
+    def parse_or(self) -> tuple:
+        node = self.parse_and()
+        while self.peek() == 'OR':
+            self.take()
+            node = (OR, node, self.parse_and())
+        return node
+
+    def parse_and(self) -> tuple:
+        node = self.parse_not()
+        while self.peek() in ('AND', 'NOT', '(', TAG):
+            if self.peek() == 'AND':
+                self.take()
+            node = (AND, node, self.parse_not())
+        return node
+
+    def parse_not(self) -> tuple:
+        kind = self.peek()
+        if kind is None:
+            raise QuerySyntaxError('unexpected end of query')
+        if kind == 'NOT':
+            self.take()
+            return NOT, self.parse_not()
+        if kind == '(':
+            self.take()
+            node = self.parse_or()
+            if self.peek() != ')':
+                raise QuerySyntaxError('missing closing parenthesis')
+            self.take()
+            return node
+        if kind == TAG:
+            return TAG, self.take()[1]
+        raise QuerySyntaxError(f'unexpected {kind!r}')
+
+
+def parse_query(text: str) -> tuple:
+    """Parse a query into nested `(operator, operand, ...)` tuples with `(TAG, name)` leaves."""
+
+    return _Parser(_tokenize(text)).parse()
+
+
+def get_query_tags(query: tuple) -> set[str]:
+    if query[0] == TAG:
+        return {query[1]}
+    return set().union(*(get_query_tags(operand) for operand in query[1:]))
+
+
+def _make_bitset(positions: list[int], size: int) -> int:
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def _evaluate(query: tuple, bitsets: dict[str, int], universe: int) -> int:
+    operator = query[0]
+    if operator == TAG:
+        return bitsets[query[1]]
+    if operator == NOT:
+        return universe & ~_evaluate(query[1], bitsets, universe)
+
+    left = _evaluate(query[1], bitsets, universe)
+    right = _evaluate(query[2], bitsets, universe)
+    return left & right if operator == AND else left | right
+
+
+def evaluate_query(query: tuple, index: dict) -> list[str]:
+    """Get the names of indexed entries matching a parsed query in ascending order."""
+
+    names = sorted(index['entries'])
+    positions = {name: position for position, name in enumerate(names)}
+    postings = index['tags']
+    bitsets = {
+        tag: _make_bitset([positions[name] for name in postings.get(tag, ()) if name in positions], len(names))
+        for tag in get_query_tags(query)
+    }
+
+    result = _evaluate(query, bitsets, universe=(1 << len(names)) - 1)
+    # bin() lists the bits from the highest, reversed it is indexed by position
+    bits = bin(result)[:1:-1]
+    return [names[position] for position, bit in enumerate(bits) if bit == '1']
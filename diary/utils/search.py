@@ -0,0 +1,170 @@
+"""
+Full text search over entry texts.
+
+Postings are kept in the SQLite database at `config.SEARCH_INDEX_PATH`, so a query reads
+only the postings of its words instead of loading the whole index, and a refresh rewrites
+only the rows of changed entries. Changed entries are found by `scan_changes` against the
+manifest saved next to it, which costs one stat and one small read when nothing changed.
+"""
+import heapq
+import math
+import re
+from collections import Counter
+
+from diary import config
+from diary.utils.entries import read_entry_text
+from diary.utils.index import get_storage_backend
+from diary.utils.manifest import scan_changes, save_manifest, remove_manifest
+from diary.utils.trace import span, traced
+
+SEARCH_INDEX_VERSION = 3
+WORD_PATTERN = re.compile(r'\w+')
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS docs (id INTEGER PRIMARY KEY, name TEXT UNIQUE, length INTEGER);
+    CREATE TABLE IF NOT EXISTS postings (
+        term TEXT,
+        doc INTEGER,
+        count INTEGER,
+        PRIMARY KEY (term, doc)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc);
+'''
+
+
+def tokenize(text: str) -> list[str]:
+    return WORD_PATTERN.findall(text.lower())
+
+
+def _connect():
+    import sqlite3
+
+    config.SEARCH_INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(config.SEARCH_INDEX_PATH, isolation_level=None)
+    try:
+        # the index is rebuilt from entries when it is lost
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.executescript(SCHEMA)
+    except sqlite3.DatabaseError:
+        connection.close()
+        raise
+    return connection
+
+
+def _is_current(connection) -> bool:
+    meta = dict(connection.execute('SELECT key, value FROM meta').fetchall())
+    return meta == {'version': str(SEARCH_INDEX_VERSION), 'storage': get_storage_backend()}
+
+
+def open_search_index():
+    """Open the search index, an empty one if it is missing, outdated or unreadable."""
+
+    import sqlite3
+
+    with span('search.open'):
+        try:
+            connection = _connect()
+        except sqlite3.DatabaseError:
+            pass
+        else:
+            if _is_current(connection):
+                return connection
+            connection.close()
+
+        config.SEARCH_INDEX_PATH.unlink(missing_ok=True)
+        remove_manifest(config.SEARCH_MANIFEST_PATH)
+        connection = _connect()
+        connection.executemany(
+            'INSERT INTO meta (key, value) VALUES (?, ?)',
+            (('version', str(SEARCH_INDEX_VERSION)), ('storage', get_storage_backend())),
+        )
+        return connection
+
+
+def _remove_docs(connection, entry_names: list[str]):
+    for entry_name in entry_names:
+        if (row := connection.execute('SELECT id FROM docs WHERE name = ?', (entry_name,)).fetchone()) is not None:
+            connection.execute('DELETE FROM postings WHERE doc = ?', row)
+            connection.execute('DELETE FROM docs WHERE id = ?', row)
+
+
+def _add_docs(connection, entry_names: list[str]):
+    postings = []
+    for entry_name in entry_names:
+        if (text := read_entry_text(entry_name=entry_name)) is None:
+            continue
+        words = Counter(tokenize(text))
+        doc = connection.execute(
+            'INSERT INTO docs (name, length) VALUES (?, ?)', (entry_name, sum(words.values()))
+        ).lastrowid
+        postings.extend((word, doc, count) for word, count in words.items())
+
+    # inserting in key order keeps the postings b-tree writes sequential
+    postings.sort()
+    connection.executemany('INSERT INTO postings (term, doc, count) VALUES (?, ?, ?)', postings)
+
+
+@traced('search.refresh')
+def refresh_search_index():
+    """
+    Bring the search index up to date with entry texts and return a connection to it.
+
+    Only entries that `scan_changes` reports as added or modified since the last run are re-read.
+    """
+
+    connection = open_search_index()
+    diff, manifest, state = scan_changes(config.SEARCH_MANIFEST_PATH)
+    if manifest is None:
+        return connection
+
+    if diff:
+        connection.execute('BEGIN')
+        try:
+            _remove_docs(connection, diff.removed + diff.modified)
+            _add_docs(connection, diff.added + diff.modified)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+    save_manifest(config.SEARCH_MANIFEST_PATH, manifest, state)
+    return connection
+
+
+@traced('search.query')
+def search_index(connection, query: str, limit: int = config.SEARCH_RESULT_LIMIT) -> list[str]:
+    """Rank entries by tf-idf of the query words, normalized by entry length."""
+
+    doc_count = connection.execute('SELECT COUNT(*) FROM docs').fetchone()[0]
+    scores = Counter()
+
+    for word in set(tokenize(query)):
+        postings = connection.execute(
+            'SELECT d.name, p.count, d.length FROM postings p JOIN docs d ON d.id = p.doc WHERE p.term = ?',
+            (word,),
+        ).fetchall()
+        if not postings:
+            continue
+        idf = math.log(1 + doc_count / len(postings))
+        for entry_name, count, length in postings:
+            scores[entry_name] += count * idf / math.sqrt(length)
+
+    ranked = heapq.nlargest(limit, scores.items(), key=lambda i: (i[1], i[0]))
+    return [entry_name for entry_name, _ in ranked]
+
+
+def get_snippet(entry_name: str, query: str, width: int = config.SEARCH_SNIPPET_WIDTH) -> str:
+    text = read_entry_text(entry_name=entry_name)
+    if text is None:
+        return ''
+
+    lowered = text.lower()
+    positions = [p for w in tokenize(query) if (p := lowered.find(w)) != -1]
+    start = max(min(positions, default=0) - width // 3, 0)
+    snippet = ' '.join(text[start:start + width].split())
+
+    if start > 0:
+        snippet = '...' + snippet
+    if start + width < len(text):
+        snippet += '...'
+    return snippet
@@ -0,0 +1,187 @@
+"""
+Diary statistics with a per-entry cache.
+
+Word counts and media volume of every entry are cached in `config.STATS_CACHE_PATH`,
+and the manifest the cache was refreshed against in `config.STATS_MANIFEST_PATH`,
+so only entries changed since the last run are read again (see diary.utils.manifest).
+The totals, entries per month, tag counts and runs of consecutive days are kept in the
+cache as well, with the stat of the index they were taken from, and are only computed
+again when an entry or the index changed. Only the current streak depends on the day.
+"""
+import bisect
+import marshal
+import os
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+
+from diary import config
+from diary.utils.entries import read_entry_text, get_index
+from diary.utils.files import atomic_write, FSYNC_NEVER
+from diary.utils.index import get_storage_backend, get_data_dir_mtime
+from diary.utils.manifest import scan_changes, save_manifest, remove_manifest, MEDIA_PREFIX
+from diary.utils.trace import span, traced
+
+STATS_CACHE_VERSION = 3
+
+
+@dataclass(slots=True)
+class DiaryStats:
+    entries: int = 0
+    words: int = 0
+    months: dict[str, int] = field(default_factory=dict)
+    longest_streak: int = 0
+    current_streak: int = 0
+    tags: dict[str, int] = field(default_factory=dict)
+    media_files: int = 0
+    media_bytes: int = 0
+
+
+def new_stats_cache() -> dict:
+    return {'version': STATS_CACHE_VERSION, 'storage': get_storage_backend(), 'summary': None, 'entries': {}}
+
+
+def load_stats_cache() -> dict | None:
+    """Load the stats cache, leaving the per-entry records marshalled until `_get_records` needs them."""
+
+    try:
+        with span('stats.load'), open(config.STATS_CACHE_PATH, 'rb') as f:
+            cache, records = marshal.loads(f.read())
+    except (FileNotFoundError, ValueError, EOFError, TypeError):
+        return None
+
+    if cache.get('version') != STATS_CACHE_VERSION or cache.get('storage') != get_storage_backend():
+        return None
+    cache['entries'] = records
+    return cache
+
+
+def save_stats_cache(cache: dict):
+    records = cache['entries']
+    header = {key: value for key, value in cache.items() if key != 'entries'}
+    content = marshal.dumps((header, records if isinstance(records, bytes) else marshal.dumps(records)))
+
+    config.STATS_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    atomic_write(config.STATS_CACHE_PATH, content, fsync=FSYNC_NEVER)
+
+
+def _get_records(cache: dict) -> dict:
+    if isinstance(cache['entries'], bytes):
+        cache['entries'] = marshal.loads(cache['entries'])
+    return cache['entries']
+
+
+def _count_media(files: dict[str, list[int]]) -> tuple[int, int]:
+    media = [stat for file_key, stat in files.items() if file_key.startswith(MEDIA_PREFIX)]
+    return len(media), sum(size for _, size in media)
+
+
+@traced('stats.refresh')
+def refresh_stats() -> dict:
+    """Bring the cached records up to date with the entries that `scan_changes` reports as changed."""
+
+    cache = load_stats_cache()
+    if cache is None:
+        cache = new_stats_cache()
+        remove_manifest(config.STATS_MANIFEST_PATH)
+
+    diff, manifest, state = scan_changes(config.STATS_MANIFEST_PATH)
+    if manifest is None:
+        return cache
+
+    entries = _get_records(cache)
+    for entry_name in diff.removed:
+        entries.pop(entry_name, None)
+    for entry_name in diff.added + diff.modified:
+        text = read_entry_text(entry_name=entry_name)
+        entries.setdefault(entry_name, {'media_files': 0, 'media_bytes': 0})['words'] = len(text.split()) if text else 0
+
+    media_changed = {m.split('/', 1)[0] for m in diff.added_media + diff.modified_media + diff.removed_media}
+    for entry_name in media_changed.union(diff.added) - set(diff.removed):
+        record = entries.setdefault(entry_name, {'words': 0})
+        record['media_files'], record['media_bytes'] = _count_media(manifest.get(entry_name, {}))
+
+    if diff:
+        cache['summary'] = None
+        save_stats_cache(cache)
+    save_manifest(config.STATS_MANIFEST_PATH, manifest, state)
+    return cache
+
+
+def _get_runs(entry_names: list[str]) -> list[list[int]]:
+    """Get the runs of consecutive days with entries, as sorted [first day ordinal, length] pairs."""
+
+    days = set()
+    for entry_name in entry_names:
+        try:
+            days.add(date.fromisoformat(entry_name).toordinal())
+        except ValueError:
+            continue
+
+    runs = []
+    for day in sorted(days):
+        if runs and runs[-1][0] + runs[-1][1] == day:
+            runs[-1][1] += 1
+        else:
+            runs.append([day, 1])
+    return runs
+
+
+def _get_current_streak(runs: list[list[int]], today: date) -> int:
+    # today's entry may not be written yet
+    for day in (today.toordinal(), (today - timedelta(days=1)).toordinal()):
+        position = bisect.bisect_right(runs, [day, float('inf')]) - 1
+        if position >= 0 and day < runs[position][0] + runs[position][1]:
+            return day - runs[position][0] + 1
+    return 0
+
+
+def _get_index_key() -> list:
+    """Get the stat of the index file, which is replaced whenever the index changes."""
+
+    try:
+        stat = os.stat(config.INDEX_PATH)
+    except FileNotFoundError:
+        return []
+    return [stat.st_ino, stat.st_mtime_ns, stat.st_size, get_data_dir_mtime()]
+
+
+def _summarize(index: dict, records: dict) -> dict:
+    entry_names = sorted(index['entries'])
+    summary = {
+        'entries': len(entry_names),
+        'words': 0,
+        'media_files': 0,
+        'media_bytes': 0,
+        'months': dict(sorted(Counter(entry_name[:7] for entry_name in entry_names).items())),
+        'tags': {tag: len(names) for tag, names in sorted(index['tags'].items())},
+        'runs': _get_runs(entry_names),
+    }
+    for record in filter(None, map(records.get, entry_names)):
+        summary['words'] += record['words']
+        summary['media_files'] += record['media_files']
+        summary['media_bytes'] += record['media_bytes']
+    return summary
+
+
+def collect_stats(today: date = None) -> DiaryStats:
+    cache = refresh_stats()
+    summary = cache['summary']
+    if summary is None or summary['index_key'] != _get_index_key():
+        summary = _summarize(get_index(), _get_records(cache))
+        # the index is saved when it had to be rebuilt, so its key is taken after loading it
+        summary['index_key'] = _get_index_key()
+        cache['summary'] = summary
+        save_stats_cache(cache)
+
+    runs = summary['runs']
+    return DiaryStats(
+        entries=summary['entries'],
+        words=summary['words'],
+        months=summary['months'],
+        longest_streak=max((length for _, length in runs), default=0),
+        current_streak=_get_current_streak(runs, today=today or date.today()),
+        tags=summary['tags'],
+        media_files=summary['media_files'],
+        media_bytes=summary['media_bytes'],
+    )
@@ -0,0 +1,430 @@
+"""
+Storage backends for entry texts and metadata.
+
+The backend is chosen by `config.STORAGE_BACKEND` or the DIARY_STORAGE environment variable:
+
+* `directory` keeps every entry in its own directory under `config.DATA_DIR`,
+  with closed years optionally rolled into pack files (see `diary.utils.packs`);
+* `sqlite` keeps entry texts and metadata in a single SQLite database file.
+
+Media files stay in entry media directories under `config.DATA_DIR` with both backends.
+Caches are validated against the data directory mtime, so the SQLite backend touches
+the data directory whenever entries are added or removed.
+"""
+import mmap
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Iterator
+
+from diary import config
+from diary.utils.files import atomic_write
+from diary.utils.index import get_data_dir_mtime, accept_data_dir_change, get_storage_backend
+from diary.utils.layout import (
+    get_entry_dir, make_entry_dir, remove_entry_dir, iter_entry_dirs, touch_data_dir, note_entry_change,
+)
+from diary.utils.packs import get_packed_record, get_packed_range, iter_packed_names, read_packed, unpack_entry, TEXT, META
+from diary.utils.trace import span, traced
+
+DIRECTORY = 'directory'
+SQLITE = 'sqlite'
+
+
+class StorageError(Exception):
+    pass
+
+
+class Storage:
+    """Interface of the storage backends, entries are addressed by name."""
+
+    name: str
+
+    def iter_names(self, since: str = None, until: str = None) -> Iterator[str]:
+        """Iterate over names of entries between two dates (inclusive, either may be None)."""
+        raise NotImplementedError
+
+    def exists(self, entry_name: str) -> bool:
+        raise NotImplementedError
+
+    def create(self, entry_name: str) -> bool:
+        """Create an empty entry unless it exists, False if it can not be created."""
+        raise NotImplementedError
+
+    def get_text_file(self, entry_name: str) -> Path | None:
+        """Get the file holding the entry text for editing in place, None if texts are not kept in files."""
+        raise NotImplementedError
+
+    def read_text(self, entry_name: str) -> str | None:
+        raise NotImplementedError
+
+    def write_text(self, entry_name: str, text: str, mtime_ns: int = None):
+        raise NotImplementedError
+
+    def stat_text(self, entry_name: str) -> tuple[int, int] | None:
+        """Get the mtime and size of the entry text."""
+        raise NotImplementedError
+
+    @contextmanager
+    def map_text(self, entry_name: str):
+        """
+        Expose the entry text as a bytes-like buffer with its start and end offsets, or None.
+
+        The buffer supports slicing and `find`/`rfind` within the offsets, so ranges of large
+        texts can be located without reading all of them.
+        """
+
+        text = self.read_text(entry_name)
+        if text is None:
+            yield None
+            return
+        content = text.encode()
+        yield content, 0, len(content)
+
+    def has_metadata(self, entry_name: str) -> bool:
+        raise NotImplementedError
+
+    def create_metadata(self, entry_name: str) -> bool:
+        """Create empty metadata unless it exists, False if it can not be created."""
+        raise NotImplementedError
+
+    def read_metadata(self, entry_name: str) -> str | None:
+        raise NotImplementedError
+
+    def write_metadata(self, entry_name: str, content: str):
+        raise NotImplementedError
+
+    def delete(self, entry_name: str):
+        """Remove the entry together with its media directory."""
+        raise NotImplementedError
+
+    def prepare_directory(self, entry_name: str):
+        """Make the entry directory under `config.DATA_DIR` safe to add media files to."""
+
+    def transaction(self):
+        """Group writes, so that they are applied together where the backend supports it."""
+        return nullcontext()
+
+
+@traced('fs.check')
+def check_file_ok(directory: Path, file: Path = None, create: bool = False) -> bool:
+
+    if not create:
+        return directory.exists() and (file is None or file.exists())
+
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        if file is not None:
+            file.touch(exist_ok=True)
+    except PermissionError:
+        return False
+    return True
+
+
+class DirectoryStorage(Storage):
+    name = DIRECTORY
+
+    def prepare_directory(self, entry_name: str):
+        self._unpack(entry_name)
+
+    def _unpack(self, entry_name: str):
+        """Move a packed entry back to its directory before handing out paths into it."""
+
+        if get_entry_dir(entry_name).exists():
+            return
+
+        data_mtime = get_data_dir_mtime()
+        if unpack_entry(entry_name):
+            accept_data_dir_change(data_mtime)
+
+    def _create_file(self, entry_name: str, file_name: str) -> bool:
+        self._unpack(entry_name)
+        try:
+            subdirectory = make_entry_dir(entry_name)
+        except PermissionError:
+            return False
+        return check_file_ok(directory=subdirectory, file=subdirectory / file_name, create=True)
+
+    def iter_names(self, since: str = None, until: str = None) -> Iterator[str]:
+        names = set()
+        for entry_name, _ in iter_entry_dirs(since=since, until=until):
+            names.add(entry_name)
+            yield entry_name
+
+        for entry_name in iter_packed_names():
+            if entry_name in names or (since and entry_name < since) or (until and entry_name > until):
+                continue
+            yield entry_name
+
+    def exists(self, entry_name: str) -> bool:
+        return get_entry_dir(entry_name).exists() or get_packed_record(entry_name) is not None
+
+    def create(self, entry_name: str) -> bool:
+        return self._create_file(entry_name, config.ENTRY_FILE_NAME)
+
+    def get_text_file(self, entry_name: str) -> Path | None:
+        self._unpack(entry_name)
+        filename = get_entry_dir(entry_name) / config.ENTRY_FILE_NAME
+        return filename if filename.exists() else None
+
+    def read_text(self, entry_name: str) -> str | None:
+        try:
+            with span('entry.read') as s:
+                with open(get_entry_dir(entry_name) / config.ENTRY_FILE_NAME, 'r') as f:
+                    text = f.read()
+                s['bytes'] = len(text)
+            return text
+        except FileNotFoundError:
+            pass
+
+        content = read_packed(entry_name, TEXT)
+        return content.decode() if content is not None else None
+
+    def write_text(self, entry_name: str, text: str, mtime_ns: int = None):
+        self._unpack(entry_name)
+        filename = make_entry_dir(entry_name) / config.ENTRY_FILE_NAME
+        atomic_write(filename, text)
+        if mtime_ns is not None:
+            os.utime(filename, ns=(mtime_ns, mtime_ns))
+        note_entry_change(entry_name)
+
+    def stat_text(self, entry_name: str) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(get_entry_dir(entry_name) / config.ENTRY_FILE_NAME)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            pass
+
+        record = get_packed_record(entry_name)
+        if record is None or record[TEXT] is None:
+            return None
+        return record['mtime_ns'], record[TEXT][1]
+
+    @contextmanager
+    def map_text(self, entry_name: str):
+        try:
+            f = open(get_entry_dir(entry_name) / config.ENTRY_FILE_NAME, 'rb')
+        except FileNotFoundError:
+            yield get_packed_range(entry_name, TEXT)
+            return
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                yield b'', 0, 0
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as text_map:
+                yield text_map, 0, size
+
+    def has_metadata(self, entry_name: str) -> bool:
+        self._unpack(entry_name)
+        return (get_entry_dir(entry_name) / config.METADATA_FILE_NAME).exists()
+
+    def create_metadata(self, entry_name: str) -> bool:
+        return self._create_file(entry_name, config.METADATA_FILE_NAME)
+
+    def read_metadata(self, entry_name: str) -> str | None:
+        entry_dir = get_entry_dir(entry_name)
+        if not entry_dir.exists():
+            content = read_packed(entry_name, META)
+            return content.decode() if content is not None else None
+
+        try:
+            with span('metadata.read') as s:
+                with open(entry_dir / config.METADATA_FILE_NAME, 'r') as f:
+                    content = f.read()
+                s['bytes'] = len(content)
+        except FileNotFoundError:
+            return None
+        return content
+
+    def write_metadata(self, entry_name: str, content: str):
+        atomic_write(make_entry_dir(entry_name) / config.METADATA_FILE_NAME, content)
+
+    def delete(self, entry_name: str):
+        self._unpack(entry_name)
+        remove_entry_dir(entry_name)
+
+
+class SqliteStorage(Storage):
+    name = SQLITE
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS entries (
+            name TEXT PRIMARY KEY,
+            text TEXT,
+            text_mtime_ns INTEGER,
+            text_size INTEGER,
+            metadata TEXT
+        ) WITHOUT ROWID
+    '''
+
+    def __init__(self, path: Path = None):
+        self.path = path or config.SQLITE_PATH
+        self._connection = None
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            import sqlite3
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with span('sqlite.connect'):
+                self._connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+                self._connection.execute(self.SCHEMA)
+        return self._connection
+
+    def _query(self, sql: str, params: tuple = ()) -> tuple | None:
+        with self._lock, span('sqlite.query'):
+            return self.connection.execute(sql, params).fetchone()
+
+    def _execute(self, sql: str, params: tuple = ()) -> int:
+        with self._lock, span('sqlite.write'):
+            return self.connection.execute(sql, params).rowcount
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            if self._depth == 0:
+                self.connection.execute('BEGIN')
+            self._depth += 1
+            try:
+                yield
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.connection.execute('ROLLBACK')
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self.connection.execute('COMMIT')
+
+    def iter_names(self, since: str = None, until: str = None) -> Iterator[str]:
+        with self._lock:
+            names = self.connection.execute(
+                'SELECT name FROM entries WHERE name >= ? AND name <= ? ORDER BY name',
+                (since or '', until or '\uffff'),
+            ).fetchall()
+        for (entry_name,) in names:
+            yield entry_name
+
+    def exists(self, entry_name: str) -> bool:
+        return self._query('SELECT 1 FROM entries WHERE name = ?', (entry_name,)) is not None
+
+    def create(self, entry_name: str) -> bool:
+        if self._execute(
+            'INSERT OR IGNORE INTO entries (name, text, text_mtime_ns, text_size) VALUES (?, ?, ?, ?)',
+            (entry_name, '', time.time_ns(), 0),
+        ):
+            touch_data_dir()
+        else:
+            self._execute(
+                'UPDATE entries SET text = ?, text_mtime_ns = ?, text_size = ? WHERE name = ? AND text IS NULL',
+                ('', time.time_ns(), 0, entry_name),
+            )
+        return True
+
+    def get_text_file(self, entry_name: str) -> Path | None:
+        return None
+
+    def read_text(self, entry_name: str) -> str | None:
+        row = self._query('SELECT text FROM entries WHERE name = ?', (entry_name,))
+        return row[0] if row else None
+
+    def write_text(self, entry_name: str, text: str, mtime_ns: int = None):
+        is_new = not self.exists(entry_name)
+        self._execute(
+            '''
+            INSERT INTO entries (name, text, text_mtime_ns, text_size) VALUES (?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET
+                text = excluded.text, text_mtime_ns = excluded.text_mtime_ns, text_size = excluded.text_size
+            ''',
+            (entry_name, text, mtime_ns or time.time_ns(), len(text.encode())),
+        )
+        if is_new:
+            touch_data_dir()
+        else:
+            note_entry_change(entry_name)
+
+    def stat_text(self, entry_name: str) -> tuple[int, int] | None:
+        row = self._query(
+            'SELECT text_mtime_ns, text_size FROM entries WHERE name = ? AND text IS NOT NULL', (entry_name,)
+        )
+        return tuple(row) if row else None
+
+    def iter_text_stats(self, since: str = None, until: str = None) -> Iterator[tuple[str, int, int]]:
+        """Get the name, text mtime and text size of entries between two dates, in one query."""
+
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT name, text_mtime_ns, text_size FROM entries '
+                'WHERE name >= ? AND name <= ? AND text IS NOT NULL ORDER BY name',
+                (since or '', until or '\uffff'),
+            ).fetchall()
+        yield from rows
+
+    def has_metadata(self, entry_name: str) -> bool:
+        return self._query(
+            'SELECT 1 FROM entries WHERE name = ? AND metadata IS NOT NULL', (entry_name,)
+        ) is not None
+
+    def create_metadata(self, entry_name: str) -> bool:
+        if self._execute('INSERT OR IGNORE INTO entries (name, metadata) VALUES (?, ?)', (entry_name, '')):
+            touch_data_dir()
+        else:
+            self._execute('UPDATE entries SET metadata = ? WHERE name = ? AND metadata IS NULL', ('', entry_name))
+        return True
+
+    def read_metadata(self, entry_name: str) -> str | None:
+        row = self._query('SELECT metadata FROM entries WHERE name = ?', (entry_name,))
+        return row[0] if row else None
+
+    def write_metadata(self, entry_name: str, content: str):
+        is_new = not self.exists(entry_name)
+        self._execute(
+            'INSERT INTO entries (name, metadata) VALUES (?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET metadata = excluded.metadata',
+            (entry_name, content),
+        )
+        if is_new:
+            touch_data_dir()
+
+    def _has_directory_copy(self, entry_name: str) -> bool:
+        """Check for the copy of an entry that `diary migrate-storage` leaves in the directory storage."""
+
+        entry_dir = get_entry_dir(entry_name)
+        return get_packed_record(entry_name) is not None or any(
+            (entry_dir / file_name).exists() for file_name in (config.ENTRY_FILE_NAME, config.METADATA_FILE_NAME)
+        )
+
+    def delete(self, entry_name: str):
+        self._execute('DELETE FROM entries WHERE name = ?', (entry_name,))
+        # media directories are shared with a directory storage copy of the entry, which still refers to them
+        if get_entry_dir(entry_name).exists() and not self._has_directory_copy(entry_name):
+            remove_entry_dir(entry_name)
+        touch_data_dir()
+
+
+BACKENDS = {
+    DIRECTORY: DirectoryStorage,
+    SQLITE: SqliteStorage,
+}
+
+_storage: Storage | None = None
+
+
+def make_storage(backend: str) -> Storage:
+    if backend not in BACKENDS:
+        raise StorageError(f'unknown storage backend {backend}')
+    return BACKENDS[backend]()
+
+
+def get_storage() -> Storage:
+    global _storage
+
+    if _storage is None:
+        _storage = make_storage(get_storage_backend())
+    return _storage
@@ -0,0 +1,48 @@
+"""
+Ranges of entry texts exposed as buffers by `Storage.map_text`.
+
+The functions take the buffer with the start and end offsets of the text
+and only touch the bytes they need.
+"""
+import codecs
+
+# a character takes at most 4 bytes in UTF-8
+MAX_CHAR_BYTES = 4
+
+
+def read_prefix(buffer, start: int, end: int, chars: int) -> str:
+    data = bytes(buffer[start:min(start + chars * MAX_CHAR_BYTES, end)])
+    return data.decode(errors='ignore')[:chars]
+
+
+def head_range(buffer, start: int, end: int, lines: int) -> tuple[int, int]:
+    """Get the offsets of the first lines of the text."""
+
+    position = start
+    for _ in range(lines):
+        newline = buffer.find(b'\n', position, end)
+        if newline == -1:
+            return start, end
+        position = newline + 1
+    return start, position
+
+
+def tail_range(buffer, start: int, end: int, lines: int) -> tuple[int, int]:
+    """Get the offsets of the last lines of the text, a trailing newline does not start a line."""
+
+    position = end - 1 if end > start and buffer[end - 1:end] == b'\n' else end
+    for _ in range(lines):
+        newline = buffer.rfind(b'\n', start, position)
+        if newline == -1:
+            return start, end
+        position = newline
+    return position + 1, end
+
+
+def iter_chunks(buffer, start: int, end: int, chunk_size: int):
+    """Decode the text range chunk by chunk, keeping characters split between chunks intact."""
+
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for position in range(start, end, chunk_size):
+        yield decoder.decode(buffer[position:min(position + chunk_size, end)])
+    yield decoder.decode(b'', final=True)
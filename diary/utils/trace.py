@@ -0,0 +1,109 @@
+"""
+Per-phase timing of storage and rendering code.
+
+Tracing is enabled by the root `--profile` option or the DIARY_TRACE environment variable.
+Set DIARY_TRACE to a path ending with `.json` to write a Chrome trace file
+(viewable in chrome://tracing or Perfetto), or to any other value to print a breakdown to stderr.
+Span times are inclusive, so nested phases are also counted in their parents.
+"""
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from diary import config
+
+_enabled = False
+_output = None
+_start = 0.0
+_stats: dict[str, list] = {}
+_events: list[dict] = []
+_lock = threading.Lock()
+
+
+def enable(output: str = None):
+    global _enabled, _output, _start
+
+    if _enabled:
+        return
+    _enabled = True
+    _output = output
+    _start = time.perf_counter()
+    atexit.register(report)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+@contextmanager
+def span(name: str):
+    """
+    Time a block of code under the given phase name.
+
+    Yields a dict, where the block can put a `bytes` count and other details for the trace.
+    """
+
+    if not _enabled:
+        yield {}
+        return
+
+    details = {}
+    start = time.perf_counter()
+    try:
+        yield details
+    finally:
+        end = time.perf_counter()
+        with _lock:
+            stats = _stats.setdefault(name, [0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += end - start
+            stats[2] += details.get('bytes', 0)
+            if _output:
+                _events.append({
+                    'name': name,
+                    'ph': 'X',
+                    'ts': (start - _start) * 1e6,
+                    'dur': (end - start) * 1e6,
+                    'pid': os.getpid(),
+                    'tid': threading.get_ident(),
+                    'args': details,
+                })
+
+
+def traced(name: str):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def report():
+    total = time.perf_counter() - _start
+
+    if _output:
+        with open(_output, 'w') as f:
+            json.dump({'traceEvents': _events, 'displayTimeUnit': 'ms'}, f)
+        sys.stderr.write(f'trace written to {_output}\n')
+        return
+
+    lines = [f'{"phase":<24} {"calls":>8} {"total ms":>10} {"%":>6} {"bytes":>12}']
+    for name, (calls, seconds, read) in sorted(_stats.items(), key=lambda i: -i[1][1]):
+        lines.append(
+            f'{name:<24} {calls:>8} {seconds * 1000:>10.2f} {seconds / total * 100:>6.1f} {read or "":>12}'
+        )
+    lines.append(f'{"total":<24} {"":>8} {total * 1000:>10.2f}')
+    sys.stderr.write('\n'.join(lines) + '\n')
+
+
+if trace_env := os.environ.get(config.TRACE_ENV_VAR):
+    enable(output=trace_env if trace_env.endswith('.json') else None)
@@ -1,6 +1,5 @@
-from diary.cli import cli
-from diary.config import PROGNAME
+from diary.__main__ import main
 
 
 if __name__ == '__main__':
-    cli(prog_name=PROGNAME)
+    main()
@@ -3,14 +3,15 @@ from setuptools import setup, find_packages
 setup(
     name='diary',
     version='0.1.0',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     include_package_data=True,
+    python_requires='>=3.11',
     install_requires=[
         'Click',
     ],
     entry_points={
         'console_scripts': [
-            'diary = diary.cli:cli',
+            'diary = diary.__main__:main',
         ],
     },
 )